@@ -14,11 +14,257 @@ acquisition parameters, symbol rate, and decision threshold.
 
 from ctypes import *
 import os
+import threading
+import time
+import Queue
 import numpy as np
 import matplotlib.pyplot as plt
+from ASK_sim import SimRSA
+
+rsa = None
+#20*log10(((I**2+Q**2)/100)/.001) = 20*log10(I**2+Q**2)+AVT_OFFSET
+AVT_OFFSET = 20*np.log10(1/100./.001)
+#samples converted per pass in iq_to_avt
+AVT_BLOCK = 65536
+#largest number of samples converted to dBm to estimate levels of a
+#linear power trace
+LEVEL_SAMPLES = 1000000
+#rough sustained USB 3.0 IQ transfer rate in bytes/sec, for planning only
+TRANSFER_RATE = 200e6
+
+def load_rsa(backend=None):
+	"""
+	This function loads RSA_API.dll as the instrument backend, or installs
+	backend in its place. Any object with the same API calls works, e.g.
+	ASK_sim.SimRSA() to run without an instrument.
+	"""
+	global rsa
+	if backend is None:
+		os.chdir("C:\\Tektronix\\RSA_API\\lib\\x64")
+		backend = cdll.LoadLibrary("RSA_API.dll")
+	rsa = backend
+	return rsa
+
+try:
+	load_rsa()
+except OSError:
+	#no RSA API on this machine, call load_rsa(SimRSA()) to simulate
+	pass
+
+########################################################################
+##############################CLASSES###################################
+########################################################################
 
-os.chdir("C:\\Tektronix\\RSA_API\\lib\\x64")
-rsa = cdll.LoadLibrary("RSA_API.dll")
+class TimeAxis:
+	"""
+	Lazy AvT time axis, the same values as np.linspace(0, acqTime, length)
+	computed as start+i*step only for the samples that are indexed, so no
+	record length array is built. np.asarray() (and so plt.plot) still
+	gets the full array when it is really needed.
+	"""
+	def __init__(self, start, step, length):
+		self.start = start
+		self.step = step
+		self.length = length
+
+	def __len__(self):
+		return self.length
+
+	def __getitem__(self, index):
+		if isinstance(index, slice):
+			return self.start+np.arange(*index.indices(self.length))*self.step
+		index = np.asarray(index)
+		if index.dtype == bool:
+			index = np.flatnonzero(index)
+		index = np.where(index < 0, index+self.length, index)
+		return self.start+index*self.step
+
+	def __array__(self, dtype=None):
+		axis = self.start+np.arange(self.length)*self.step
+		if dtype is not None:
+			axis = axis.astype(dtype)
+		return axis
+
+class AskStreamDemod:
+	"""
+	Stateful ASK demodulator that consumes the AvT trace (or raw IQ) one
+	block at a time. The decision threshold, first edge, and symbol
+	phase are carried across block boundaries so records of any length
+	can be demodulated with bounded memory.
+	If hi is not given, the hi/lo levels are estimated from the first
+	block handed to process().
+	"""
+	def __init__(self, symRate, sampRate, thresh, hi=None):
+		self.saPerSym = float(sampRate)/symRate
+		self.decOffset = int(self.saPerSym/2)
+		self.thresh = thresh
+		self.hi = hi
+		self.decPoint = None
+		if hi is not None:
+			self.decPoint = hi-thresh
+		self.avtBuffer = None
+		self.reset()
+
+	def reset(self):
+		#forget stream position and symbol phase, keep the threshold
+		self.position = 0
+		self.startIndex = None
+		self.symCount = 0
+		self.lastSample = None
+
+	def process(self, block):
+		"""Demods one AvT block and returns the symbols it completes"""
+		block = np.asarray(block)
+		blockStart = self.position
+		self.position += len(block)
+		if len(block) == 0:
+			return np.zeros(0, dtype=np.uint8)
+		if self.decPoint is None:
+			self.hi, lo = hi_lo_calculator(block)
+			self.decPoint = self.hi-self.thresh
+
+		if self.startIndex is None:
+			#look for the first rising edge, including the one that
+			#straddles the previous block boundary
+			below = block <= self.decPoint
+			rising = np.flatnonzero(below[:-1] & ~below[1:]) + 1
+			if (self.lastSample is not None and 
+				self.lastSample <= self.decPoint and not below[0]):
+				rising = np.insert(rising, 0, 0)
+			self.lastSample = block[-1]
+			if len(rising) == 0:
+				return np.zeros(0, dtype=np.uint8)
+			self.startIndex = blockStart + rising[0]
+
+		#every decision point that lands inside this block
+		first = self.startIndex+self.decOffset
+		lastSym = int(np.ceil((self.position-first)/self.saPerSym))
+		symbols = np.arange(self.symCount, max(lastSym, self.symCount))
+		index = (symbols*self.saPerSym+first).astype(np.int64)
+		index = index[index < self.position] - blockStart
+		self.symCount += len(index)
+		return (block[index] >= self.decPoint).astype(np.uint8)
+
+	def process_iq(self, I, Q):
+		"""Converts one IQ block to AvT and demods it"""
+		#the AvT buffer is reused for every block of the same size or smaller
+		if (self.avtBuffer is None) or (len(self.avtBuffer) < len(I)):
+			self.avtBuffer = np.empty(len(I), dtype=np.float32)
+		return self.process(iq_to_avt(I, Q, self.avtBuffer[:len(I)]))
+
+	def demod_blocks(self, blocks):
+		"""Generator that yields the symbol array for each AvT block"""
+		for block in blocks:
+			yield self.process(block)
+
+class ContinuousAcquisition:
+	"""
+	Keeps the RSA running and acquires IQ blocks back to back into a
+	small pool of preallocated buffer pairs used ping-pong fashion.
+	Each filled block is handed to handler(I, Q, sampleRate) on a
+	separate demod thread while the next block is acquired into the
+	other buffer, so the device is never stopped between captures.
+	I and Q are views on the buffers and are only valid until the
+	handler returns; copy them if they need to be kept.
+	The acquisition thread only waits when every buffer is still being
+	demodulated. A handler or acquisition exception stops the
+	acquisition and is kept in self.error until the next start().
+	"""
+	def __init__(self, recordLength, handler, numBuffers=2):
+		self.recordLength = recordLength
+		self.handler = handler
+		iqArray = c_float*recordLength
+		self.free = Queue.Queue()
+		self.filled = Queue.Queue()
+		for i in range(numBuffers):
+			self.free.put((iqArray(), iqArray()))
+		self.stopEvent = threading.Event()
+		self.threads = []
+		self.captures = 0
+		self.error = None
+		self.sampleRate = None
+		self.startTime = None
+
+	def start(self):
+		#the sample rate is read once here, handlers must not call the API
+		iqSampleRate = c_double(0)
+		rsa.IQBLK_GetIQSampleRate(byref(iqSampleRate))
+		self.sampleRate = iqSampleRate.value
+		self.error = None
+		self.stopEvent.clear()
+		rsa.DEVICE_Run()
+		self.startTime = time.time()
+		self.threads = [threading.Thread(target=self.acquire_loop),
+			threading.Thread(target=self.demod_loop)]
+		for thread in self.threads:
+			thread.daemon = True
+			thread.start()
+
+	def stop(self):
+		self.stopEvent.set()
+		#unblock both loops in case they are waiting on a queue
+		self.free.put(None)
+		self.filled.put(None)
+		for thread in self.threads:
+			thread.join()
+		rsa.DEVICE_Stop()
+		#drain the wakeup markers and return every buffer pair to the free
+		#pool (filled blocks also carry their length) so start() can be
+		#called again
+		buffers = []
+		for pool in (self.free, self.filled):
+			while not pool.empty():
+				item = pool.get()
+				if item is not None:
+					buffers.append(item[:2])
+		for item in buffers:
+			self.free.put(item)
+
+	def rate(self):
+		"""Returns the average number of captures per second"""
+		if self.startTime is None:
+			return 0
+		return self.captures/max(time.time()-self.startTime, 1e-9)
+
+	def acquire_loop(self):
+		buffers = None
+		try:
+			while not self.stopEvent.is_set():
+				buffers = self.free.get()
+				if buffers is None:
+					break
+				iData, qData = buffers
+				actLength = fetch_iq(self.recordLength, iData, qData, self.stopEvent)
+				if actLength == 0:
+					self.free.put(buffers)
+					break
+				self.filled.put((iData, qData, actLength))
+				buffers = None
+		except Exception as error:
+			self.error = error
+			self.stopEvent.set()
+			if buffers is not None:
+				self.free.put(buffers)
+			#wake the demod thread if it is waiting for a block
+			self.filled.put(None)
+
+	def demod_loop(self):
+		while True:
+			block = self.filled.get()
+			if block is None:
+				break
+			iData, qData, actLength = block
+			I = np.ctypeslib.as_array(iData)[:actLength]
+			Q = np.ctypeslib.as_array(qData)[:actLength]
+			try:
+				self.handler(I, Q, self.sampleRate)
+			except Exception as error:
+				self.error = error
+				self.stopEvent.set()
+			self.captures += 1
+			self.free.put((iData, qData))
+			if self.stopEvent.is_set():
+				break
 
 ########################################################################
 #############################FUNCTIONS##################################
@@ -74,29 +320,128 @@ def search_connect():
 		return rsa
 
 
-def hi_lo_calculator(data):
-	#This function uses the histogram method to determine hi/low
-	DEFAULT = 40
-	hi = lo = DEFAULT
-	abs_half = (np.amax(data)+np.amin(data))/2
-	hist, bins = np.histogram(data,50)
-	plt.hist(data, 50)
-	plt.show()
-	while (hi == DEFAULT) or (lo == DEFAULT):
-		index = np.argmax(hist)
-		amp = bins[index]
-		if amp >= abs_half:
-			if hi == DEFAULT:		
-				hi = amp
-			hist = np.delete(hist,index)
-			bins = np.delete(bins,index)
-		elif amp < abs_half:
-			hist = np.delete(hist,index)
-			bins = np.delete(bins,index)
-			lo = amp	
-	print('Hi: {} Lo: {}'.format(hi,lo))
+def level_estimator(data, method='histogram', bins=50, pct=10):
+	"""
+	This function estimates the hi and lo levels of the AvT trace in a
+	single vectorized pass and never plots. Methods:
+	'histogram' picks the most populated bin above and below the midpoint
+		of the trace extremes (same result as the original loop)
+	'otsu' splits the histogram into the two clusters with the largest
+		between-class variance (2-means) and returns the cluster means
+	'percentile' returns the pct and 100-pct percentiles of the trace
+	Returns hi, lo, and a confidence dict with 'separability' (between 
+	class variance over total variance, 0 to 1), 'snr' (hi-lo over the
+	pooled cluster standard deviation), and 'split' (the level used to
+	separate the two clusters).
+	"""
+	data = np.asarray(data)
+	if not np.isfinite(data).all():
+		#exact zero IQ samples are -inf dBm
+		data = data[np.isfinite(data)]
+	hist, edges = np.histogram(data, bins)
+	hist = hist.astype(np.float64)
+	left = edges[:-1]
+	centers = (edges[:-1]+edges[1:])/2
+
+	if method == 'histogram':
+		#edges[0] and edges[-1] are the trace min and max
+		split = (edges[0]+edges[-1])/2
+		upper = left >= split
+		if upper.all() or not upper.any():
+			hi = lo = left[np.argmax(hist)]
+		else:
+			hi = left[upper][np.argmax(hist[upper])]
+			lo = left[~upper][np.argmax(hist[~upper])]
+	elif method == 'otsu':
+		w0 = np.cumsum(hist)[:-1]
+		w1 = hist.sum()-w0
+		m0 = np.cumsum(hist*centers)[:-1]
+		with np.errstate(divide='ignore', invalid='ignore'):
+			mu0 = m0/w0
+			mu1 = (np.sum(hist*centers)-m0)/w1
+			between = np.nan_to_num(w0*w1*(mu0-mu1)**2)
+		k = np.argmax(between)
+		split = edges[k+1]
+		hi = mu1[k]
+		lo = mu0[k]
+	elif method == 'percentile':
+		lo, hi = np.percentile(data, [pct, 100-pct])
+		split = (hi+lo)/2
+	else:
+		raise ValueError('Unknown level estimation method: {}'.format(method))
+
+	#confidence metrics from the histogram split into two clusters
+	upper = centers >= split
+	w0 = hist[~upper].sum()
+	w1 = hist[upper].sum()
+	confidence = {'separability': 0.0, 'snr': 0.0, 'split': split}
+	if (w0 > 0) and (w1 > 0):
+		mu0 = np.sum(hist[~upper]*centers[~upper])/w0
+		mu1 = np.sum(hist[upper]*centers[upper])/w1
+		var0 = np.sum(hist[~upper]*(centers[~upper]-mu0)**2)/w0
+		var1 = np.sum(hist[upper]*(centers[upper]-mu1)**2)/w1
+		total = w0+w1
+		between = (w0/total)*(w1/total)*(mu1-mu0)**2
+		within = (w0*var0+w1*var1)/total
+		if between+within > 0:
+			confidence['separability'] = between/(between+within)
+		if var0+var1 > 0:
+			confidence['snr'] = (mu1-mu0)/np.sqrt((var0+var1)/2)
+	return hi, lo, confidence
+
+def hi_lo_calculator(data, method='histogram'):
+	#This function determines hi/low levels, see level_estimator()
+	hi, lo, confidence = level_estimator(data, method)
 	return hi, lo
 
+def edge_finder(data, decPoint, hysteresis=0, min_width=0):
+	"""
+	This function finds every rising and falling crossing of decPoint in
+	one vectorized pass and returns them as two index arrays (the index
+	of the first sample on the new side of the threshold).
+	hysteresis is a band in dB centered on decPoint: a sample only
+	switches the state high above decPoint+hysteresis/2 or low at or
+	below decPoint-hysteresis/2, anything in between holds the state.
+	min_width rejects glitches: high or low runs shorter than min_width
+	samples are merged into the run before them.
+	"""
+	data = np.asarray(data)
+	if len(data) == 0:
+		return np.zeros(0, dtype=np.int64), np.zeros(0, dtype=np.int64)
+	if hysteresis > 0:
+		high = data > decPoint+hysteresis/2.0
+		low = data <= decPoint-hysteresis/2.0
+		#forward fill the last decided state through the band
+		decided = np.where(high | low, np.arange(len(data)), 0)
+		np.maximum.accumulate(decided, out=decided)
+		state = high[decided]
+		if not (high[0] or low[0]):
+			#samples before the first decision take the plain comparison
+			undecided = decided == 0
+			state[undecided] = data[undecided] > decPoint
+	else:
+		state = data > decPoint
+
+	edges = np.flatnonzero(state[1:] != state[:-1]) + 1
+	new_state = state[edges]
+	if (min_width > 1) and (len(edges) > 0):
+		#run length encode the state and absorb short runs
+		starts = np.concatenate(([0], edges))
+		lengths = np.diff(np.concatenate((starts, [len(data)])))
+		values = state[starts]
+		keep = lengths >= min_width
+		keep[0] = True
+		owner = np.where(keep, np.arange(len(starts)), 0)
+		np.maximum.accumulate(owner, out=owner)
+		values = values[owner]
+		change = np.flatnonzero(values[1:] != values[:-1]) + 1
+		edges = starts[change]
+		new_state = values[change]
+
+	rising = edges[new_state]
+	falling = edges[~new_state]
+	return rising, falling
+
 def firstedge_finder(data, hi, lo, thresh):
 	"""
 	This function finds the first rising edge of the AvT trace and
@@ -104,42 +449,92 @@ def firstedge_finder(data, hi, lo, thresh):
 	"""
 	#decPoint = (hi+lo)*.5
 	decPoint = hi-thresh
-	saved = data[0]
-
-	for index in range(len(data)):
-		if data[index] <= decPoint:
-			saved = data[index]
-		else:
-			if saved <= decPoint:
-				break
+	rising, falling = edge_finder(data, decPoint)
+	if len(rising) > 0:
+		index = rising[0]
+	else:
+		index = len(data)-1
 
 	#print('Hi: {0} Lo: {1} decPoint: {2}'.format(hi,lo,decPoint))
 	return index, decPoint
 
-def ask_decode(data, symRate, sampRate, thresh):
+def symbol_slicer(data, decPoint, startIndex, decOffset, saPerSym, validSym):
+	"""
+	This function computes every decision index at once and slices the
+	AvT trace against decPoint in a single array operation. Indices are
+	truncated to integers the same way the old per-symbol loop did, and
+	any that run off the end of the trace are dropped. Returns the
+	symbol table as a uint8 array.
+	"""
+	index = np.arange(validSym)*saPerSym+decOffset+startIndex
+	index = index.astype(np.int64)
+	index = index[index < len(data)]
+	return (data[index] >= decPoint).astype(np.uint8)
+
+def integrate_slicer(data, decPoint, startIndex, saPerSym, validSym, window=0.8):
+	"""
+	This function makes integrate-and-dump symbol decisions. Each symbol
+	is decided from the mean of the AvT trace over the central window
+	fraction of its symbol period (the symbol edges are skipped) instead
+	of a single sample, so noise is averaged down and far fewer samples
+	per symbol are needed. All the sums come from one cumulative sum.
+	Symbols whose window runs off the end of the trace are dropped.
+	Returns the symbol table as a uint8 array.
+	"""
+	guard = saPerSym*(1-window)/2
+	symbols = np.arange(validSym)*saPerSym+startIndex
+	starts = (symbols+guard).astype(np.int64)
+	stops = np.maximum((symbols+saPerSym-guard).astype(np.int64), starts+1)
+	keep = stops <= len(data)
+	starts, stops = starts[keep], stops[keep]
+	total = np.zeros(len(data)+1)
+	np.cumsum(data, dtype=np.float64, out=total[1:])
+	means = (total[stops]-total[starts])/(stops-starts)
+	return (means >= decPoint).astype(np.uint8)
+
+def pack_symbols(symTable):
+	"""This function bit-packs a symbol table, 8 symbols per byte"""
+	return np.packbits(np.asarray(symTable, dtype=np.uint8))
+
+def ask_decode(data, symRate, sampRate, thresh, decision='sample', linear=False):
 	"""
 	This function demods the AvT trace based on symbol rate, sample rate,
 	and decision threshold as a percentage of amplitude. It begins demod
 	at the first rising edge of the AvT trace. It returns the symbol table 
 	and info needed to annotate the resulting plot.
+	decision is 'sample' to slice one sample at the center of each symbol
+	or 'integrate' for integrate-and-dump decisions (see integrate_slicer)
+	linear=True takes the linear power trace from iq_to_avt(linear=True)
+	and never converts it to dBm: the levels are estimated from at most
+	LEVEL_SAMPLES evenly spaced samples (all of them for shorter records,
+	giving the same levels as the dBm trace), and the edge search and
+	decisions compare the power against the decision point converted to
+	linear power once. decPoint in the annotations stays in dBm.
+	Integrate-and-dump then averages power instead of dBm.
 	"""
 	saPerSym = sampRate/symRate
-	hi, lo = hi_lo_calculator(data)
-	startIndex, decPoint = firstedge_finder(data, hi, lo, thresh)
+	if linear:
+		step = max(len(data)//LEVEL_SAMPLES, 1)
+		hi, lo = hi_lo_calculator(power_to_avt(data[::step]))
+		decPoint = hi-thresh
+		cut = avt_to_power(decPoint)
+		rising, falling = edge_finder(data, cut)
+		startIndex = rising[0] if len(rising) > 0 else len(data)-1
+	else:
+		hi, lo = hi_lo_calculator(data)
+		startIndex, decPoint = firstedge_finder(data, hi, lo, thresh)
+		cut = decPoint
 	decOffset = int((saPerSym/2))
 	numSym = int(len(data)/saPerSym)
 	validSym = numSym - int((startIndex+decOffset)/saPerSym)
-	symTable = np.zeros(validSym)
-
-	for i in range(validSym):
-		if i == 0:
-			index = startIndex+decOffset
-		index = i*saPerSym+decOffset+startIndex
-		decision = data[index]
-		if decision >= decPoint:
-			symTable[i] = 1
-		else:
-			symTable[i] = 0
+	if decision == 'integrate':
+		symTable = integrate_slicer(data, cut, startIndex, saPerSym, validSym)
+	elif decision == 'sample':
+		symTable = symbol_slicer(data, cut, startIndex, decOffset, 
+			saPerSym, validSym)
+	else:
+		raise ValueError('Unknown decision mode: {0}'.format(decision))
+	validSym = len(symTable)
 
 	annotations = [decPoint, startIndex, decOffset, validSym, saPerSym]
 	return symTable, annotations
@@ -152,30 +547,116 @@ def inst_setup(measFreq, refLevel, measBW, measTime, trigLevel):
 	rsa.IQBLK_SetIQBandwidth(c_double(measBW))
 	recordLength = c_int(int(measBW*1.4*measTime))
 	rsa.IQBLK_SetIQRecordLength(recordLength)
+	trig_setup(trigLevel)
+
+	return recordLength.value
+
+def trig_setup(trigLevel):
+	#IF power trigger at the start of the record
 	rsa.TRIG_SetTriggerMode(c_int(1))	#1=triggered
 	rsa.TRIG_SetIFPowerTriggerLevel(c_double(trigLevel))
 	rsa.TRIG_SetTriggerSource(c_int(1))	#1=internal
 	rsa.TRIG_SetTriggerPositionPercent(c_double(0))
 
-	return recordLength.value
 
-
-def acquire_iq(recordLength):
-	#start acquisition
+def plan_acquisition(symRate, packetSymbols, saPerSym=16, margin=0.25,
+	sampleRate=None):
+	"""
+	This function plans the smallest acquisition that captures a packet
+	of packetSymbols symbols at symRate with at least saPerSym samples
+	per symbol. The IQ bandwidth is the larger of the 2*symRate main lobe
+	and what gives saPerSym samples per symbol at 1.4x the bandwidth, 
+	clamped to the instrument's supported range. The measurement time
+	covers the packet plus margin (fractional) for trigger and timing
+	slop, and the record length is clamped to the instrument maximum.
+	The instrument picks the IQ sample rate for a bandwidth from a fixed
+	set, anywhere from 1.4x to about 2.8x the bandwidth, so the record
+	length is only right for the sampleRate actually in use (read with
+	IQBLK_GetIQSampleRate after setting the bandwidth, see plan_setup).
+	Without it 1.4x the bandwidth is assumed, which plans the record too
+	short whenever the real rate is higher.
+	Returns a dict with the planned iqBandwidth, sampleRate, measTime,
+	recordLength, and saPerSym, plus the expected transferBytes (I and
+	Q as float32) and transferTime at TRANSFER_RATE.
+	"""
+	minBW = c_double(0)
+	maxBW = c_double(0)
+	maxLength = c_int(0)
+	rsa.IQBLK_GetMinIQBandwidth(byref(minBW))
+	rsa.IQBLK_GetMaxIQBandwidth(byref(maxBW))
+	rsa.IQBLK_GetMaxIQRecordLength(byref(maxLength))
+
+	iqBandwidth = max(2.0*symRate, saPerSym*symRate/1.4)
+	iqBandwidth = min(max(iqBandwidth, minBW.value), maxBW.value)
+	if sampleRate is None:
+		sampleRate = iqBandwidth*1.4
+	measTime = packetSymbols/float(symRate)*(1+margin)
+	recordLength = min(int(np.ceil(sampleRate*measTime)), maxLength.value)
+	measTime = recordLength/sampleRate
+	transferBytes = recordLength*2*4
+	return {'iqBandwidth': iqBandwidth, 'sampleRate': sampleRate,
+		'measTime': measTime, 'recordLength': recordLength,
+		'saPerSym': sampleRate/symRate, 'transferBytes': transferBytes,
+		'transferTime': transferBytes/TRANSFER_RATE}
+
+def plan_setup(measFreq, refLevel, trigLevel, symRate, packetSymbols, 
+	saPerSym=16):
+	"""
+	This function plans the acquisition with plan_acquisition and
+	applies it. The planned IQ bandwidth is set first and the IQ sample
+	rate the instrument picked for it is read back, the record length
+	is then planned from that rate and set as is. Returns the plan and
+	a printable summary.
+	"""
+	plan = plan_acquisition(symRate, packetSymbols, saPerSym)
+	rsa.CONFIG_SetReferenceLevel(c_double(refLevel))
+	rsa.CONFIG_SetCenterFreq(c_double(measFreq))
+	rsa.IQBLK_SetIQBandwidth(c_double(plan['iqBandwidth']))
+	iqSampleRate = c_double(0)
+	rsa.IQBLK_GetIQSampleRate(byref(iqSampleRate))
+	plan = plan_acquisition(symRate, packetSymbols, saPerSym, 
+		sampleRate=iqSampleRate.value)
+	rsa.IQBLK_SetIQRecordLength(c_int(plan['recordLength']))
+	trig_setup(trigLevel)
+	summary = ('IQ bandwidth {iqBandwidth:.6g} Hz, {sampleRate:.6g} Sa/s, '
+		'{saPerSym:.1f} Sa/sym\nRecord {recordLength} samples ({measTime:.6g} s), '
+		'{transferBytes} bytes, ~{transferTime:.3g} s transfer'.format(**plan))
+	return plan, summary
+
+def fetch_iq(recordLength, iData, qData, stopEvent=None):
+	"""
+	Triggers one IQ block acquisition on a device that is already
+	running and copies it into the iData/qData ctypes buffers.
+	Returns the number of samples received, or 0 if stopEvent was set
+	while waiting for the trigger.
+	"""
 	timeoutMsec = c_int(200)
 	ready = c_bool(False)
-	rsa.DEVICE_Run()
 	rsa.IQBLK_AcquireIQData()
 	#check for data ready
 	while ready.value == False:
+		if (stopEvent is not None) and stopEvent.is_set():
+			return 0
 		ret = rsa.IQBLK_WaitForIQDataReady(timeoutMsec, byref(ready))
-	#Get IQ arrays from RSA
-	iqArray =  c_float*recordLength
-	iData = iqArray()
-	qData = iqArray()
-
 	actLength = c_int(0)
 	rsa.IQBLK_GetIQDataDeinterleaved(byref(iData), byref(qData), byref(actLength), c_int(recordLength))
+	return actLength.value
+
+def acquire_iq(recordLength, iData=None, qData=None):
+	"""
+	Acquires one IQ block. Pass iData and qData (c_float*recordLength
+	arrays) to reuse the same buffers across acquisitions instead of
+	allocating a new pair every time. I and Q are views on those buffers.
+	"""
+	#Get IQ arrays from RSA
+	if (iData is None) or (qData is None):
+		iqArray =  c_float*recordLength
+		iData = iqArray()
+		qData = iqArray()
+
+	#start acquisition
+	rsa.DEVICE_Run()
+	fetch_iq(recordLength, iData, qData)
 	rsa.DEVICE_Stop()
 
 	#convert ctypes array to numpy array for ease of use
@@ -185,14 +666,93 @@ def acquire_iq(recordLength):
 	return I, Q
 	
 
-def get_avt(I, Q, recordLength):
-	#convert IQ to amplitude vs time and return both amplitude and time arrays
-	avt = 20*np.log10(((I**2 + Q**2)/100)/.001)
+def iq_blocks(I, Q, blockLength):
+	"""Generator that yields (I, Q) views of blockLength samples"""
+	for start in xrange(0, len(I), blockLength):
+		yield I[start:start+blockLength], Q[start:start+blockLength]
+
+def iq_to_avt(I, Q, out=None, linear=False):
+	"""
+	This function converts IQ to amplitude vs time in dBm, 
+	20*log10(((I**2+Q**2)/100)/.001), without full length temporaries.
+	I**2+Q**2 is computed into out (a float32 array of the same length,
+	allocated if not given) with np.multiply(..., out=), then one log10
+	pass with the scale factors folded into AVT_OFFSET. The record is
+	worked through AVT_BLOCK samples at a time so Q**2 only needs one
+	small scratch block that stays in cache.
+	linear=True skips the log10 and returns the linear power I**2+Q**2,
+	convert thresholds with avt_to_power() instead of the trace.
+	"""
+	if out is None:
+		out = np.empty(len(I), dtype=np.float32)
+	scratch = np.empty(min(AVT_BLOCK, len(out)), dtype=out.dtype)
+	for start in xrange(0, len(out), AVT_BLOCK):
+		block = out[start:start+AVT_BLOCK]
+		square = scratch[:len(block)]
+		np.multiply(I[start:start+AVT_BLOCK], I[start:start+AVT_BLOCK], out=block)
+		np.multiply(Q[start:start+AVT_BLOCK], Q[start:start+AVT_BLOCK], out=square)
+		np.add(block, square, out=block)
+		if not linear:
+			with np.errstate(divide='ignore'):
+				np.log10(block, out=block)
+			np.multiply(block, 20, out=block)
+			np.add(block, AVT_OFFSET, out=block)
+	return out
+
+def avt_to_power(level):
+	#AvT level(s) in dBm to the linear power returned by iq_to_avt(linear=True)
+	return 10**((np.asarray(level, dtype=np.float64)-AVT_OFFSET)/20)
+
+def power_to_avt(power, out=None):
+	"""
+	This function converts linear power from iq_to_avt(linear=True) to
+	AvT in dBm, into out if given. Only convert what is displayed or
+	needed for level estimates, the demod itself stays linear.
+	"""
+	power = np.asarray(power)
+	if out is None:
+		out = np.empty(power.shape, dtype=np.float32)
+	with np.errstate(divide='ignore'):
+		np.log10(power, out=out)
+	np.multiply(out, 20, out=out)
+	np.add(out, AVT_OFFSET, out=out)
+	return out
+
+def envelope_decimator(data, sampRate, symRate, targetSaPerSym=16):
+	"""
+	This function decimates the envelope (best the linear power from
+	iq_to_avt(linear=True), averaging dBm averages the log) down to about
+	targetSaPerSym samples per symbol before ask_decode. The decimation
+	factor is picked from the symbol rate, and each output sample is the
+	mean of factor input samples: a first order CIC (boxcar) low-pass
+	and downsample in one reshape, without copying the input. Leftover
+	samples that don't fill a whole output sample are dropped.
+	Returns the decimated trace, its sample rate, and the factor (1 and
+	the trace untouched if it already has few enough samples per symbol).
+	"""
+	factor = int(float(sampRate)/symRate/targetSaPerSym)
+	if factor <= 1:
+		return data, sampRate, 1
+	data = np.asarray(data)
+	length = len(data)//factor*factor
+	decimated = data[:length].reshape(-1, factor).mean(axis=1, dtype=np.float64)
+	return decimated.astype(np.float32), sampRate/float(factor), factor
+
+def get_avt(I, Q, recordLength, out=None, linear=False):
+	"""
+	This function converts IQ to amplitude vs time (see iq_to_avt for
+	out and linear) and returns the AvT, its time axis, and the IQ sample
+	rate. The time axis is a lazy TimeAxis, not a record length array.
+	"""
+	avt = iq_to_avt(I, Q, out, linear)
 	iqSampleRate = c_double(0)
 	rsa.IQBLK_GetIQSampleRate(byref(iqSampleRate))
-	time = np.linspace(0,recordLength/iqSampleRate.value,recordLength)
+	step = 0
+	if recordLength > 1:
+		step = recordLength/iqSampleRate.value/(recordLength-1)
+	avtTime = TimeAxis(0, step, recordLength)
 
-	return avt, time, iqSampleRate.value
+	return avt, avtTime, iqSampleRate.value
 
 
 def err_check(instrument):
@@ -204,7 +764,10 @@ def err_check(instrument):
 
 	return status_text
 
-def ask_plot(x, y, annotations, acq_time):
+def ask_plot(x, y, annotations, acq_time, linear=False):
+	#linear=True plots a linear power trace, converted to dBm for display
+	if linear:
+		y = power_to_avt(y)
 	plt.plot(x, y)
 	plt.axhline(y=annotations[0])
 	#plt.axvline(x=x[annotations[1]])
@@ -229,10 +792,9 @@ def main():
 	"""
 	measFreq = 2.4553e9
 	refLevel = 0
-	measBW = 40e6
-	measTime = 1e-3
 	trigLevel = -10
 	symRate = 100
+	packetSymbols = 64
 	thresh = 3
 	"""
 	########################################################################
@@ -241,18 +803,27 @@ def main():
 	"""
 	#establish communication with RSA
 	rsa = search_connect()
-	recordLength = inst_setup(measFreq, refLevel, measBW, measTime, trigLevel)
+	#smallest bandwidth and record length for the packet
+	plan, summary = plan_setup(measFreq, refLevel, trigLevel, symRate,
+		packetSymbols)
+	print(summary)
+	recordLength = plan['recordLength']
+	measTime = plan['measTime']
 	#status_text = err_check(rsa)
 	#if status_text != 0:
 	#	print status_text
 	I, Q = acquire_iq(recordLength)
-	avt, avtTime, Fs = get_avt(I, Q, recordLength)
+	#linear power, only the plot converts it to dBm
+	power, avtTime, Fs = get_avt(I, Q, recordLength, linear=True)
+	#demod at about 16 samples per symbol instead of the full IQ rate
+	power, Fs, factor = envelope_decimator(power, Fs, symRate)
+	avtTime = TimeAxis(avtTime.step*(factor-1)/2.0, avtTime.step*factor, len(power))
 
 	#demodulate and get symbol table
-	symbol_table, annot = ask_decode(avt, symRate, Fs, thresh)
+	symbol_table, annot = ask_decode(power, symRate, Fs, thresh, linear=True)
 
 	#plot the data
-	ask_plot(avtTime, avt, annot, measTime)
+	ask_plot(avtTime, power, annot, measTime, linear=True)
 
 
 if __name__ == '__main__':
@@ -0,0 +1,211 @@
+"""
+ASK_sim.py
+Simulated RSA_API.dll backend for ASK_demod_guts.py
+Implements the RSA API calls the demodulator makes and serves 
+synthesized 2ASK/OOK/Manchester bursts, so the full acquire -> demod
+pipeline can be run and timed without an instrument or Windows.
+Install it with load_rsa(SimRSA()) before calling search_connect().
+"""
+
+from ctypes import *
+import numpy as np
+
+########################################################################
+#############################FUNCTIONS##################################
+########################################################################
+def synth_ask(bits, sym_rate, samp_rate, record_length=None, trig_pos=0.1,
+	hi_level=-10, lo_level=-40, noise_level=-70, cfo=0, jitter=0,
+	coding='ask', seed=None):
+	"""
+	This function synthesizes the complex baseband IQ of an ASK burst
+	bits is the data sequence, sym_rate is the data rate in bits/sec
+	hi_level/lo_level are the on/off carrier levels in dBm (use a very
+	low lo_level for OOK), noise_level is the noise power in dBm
+	cfo is the carrier frequency offset in Hz
+	jitter is the RMS timing jitter of each symbol edge in symbols
+	coding is 'ask' or 'manchester' (01 = 1, 10 = 0, sent at 2x sym_rate)
+	trig_pos is the fraction of the record before the burst starts
+	Returns the IQ array in volts (50 ohm) and the burst start index
+	"""
+	rng = np.random.RandomState(seed)
+	bits = np.asarray(bits, dtype=np.uint8)
+	if coding == 'manchester':
+		chips = np.empty(2*len(bits), dtype=np.uint8)
+		chips[0::2] = 1-bits
+		chips[1::2] = bits
+		bits = chips
+		sym_rate = sym_rate*2
+	elif coding != 'ask':
+		raise ValueError('Unknown line coding: {0}'.format(coding))
+
+	sa_per_sym = float(samp_rate)/sym_rate
+	burst_length = int(np.ceil(len(bits)*sa_per_sym))
+	if record_length is None:
+		record_length = int(burst_length/(1-trig_pos))+1
+	start = int(trig_pos*record_length)
+
+	#symbol edges with timing jitter, then the symbol each sample is in
+	edges = start+np.arange(len(bits)+1)*sa_per_sym
+	edges[1:-1] += rng.randn(len(bits)-1)*jitter*sa_per_sym
+	n = np.arange(record_length)
+	sym_index = np.searchsorted(edges, n, side='right')-1
+	in_burst = (sym_index >= 0) & (sym_index < len(bits))
+	on = np.zeros(record_length, dtype=bool)
+	on[in_burst] = bits[sym_index[in_burst]] == 1
+
+	#dBm to volts peak for a 50 ohm load
+	hi_amp = np.sqrt(100*1e-3*10**(hi_level/10.0))
+	lo_amp = np.sqrt(100*1e-3*10**(lo_level/10.0))
+	amp = np.where(on, hi_amp, 0.0)
+	amp[in_burst & ~on] = lo_amp
+	iq = amp*np.exp(2j*np.pi*cfo*n/samp_rate)
+
+	noise_amp = np.sqrt(100*1e-3*10**(noise_level/10.0)/2)
+	iq += noise_amp*(rng.randn(record_length)+1j*rng.randn(record_length))
+	return iq.astype(np.complex64), start
+
+def deref(arg):
+	#unwrap a byref() argument to the ctypes object it points to
+	return getattr(arg, '_obj', arg)
+
+########################################################################
+##############################CLASSES###################################
+########################################################################
+
+class SimRSA:
+	"""
+	Simulated RSA306 that answers the RSA_API.dll calls used by
+	ASK_demod_guts.py. Every IQBLK_AcquireIQData synthesizes a new
+	record using the bandwidth and record length last configured. Like
+	the RSA306 the IQ sample rate is the lowest of 56 MSa/s divided by
+	a power of 2 that is at least 1.4x the IQ bandwidth (1.4x to 2.8x
+	the bandwidth), the IQ bandwidth range is 100 Hz to 40 MHz, and
+	records are limited to 126M samples.
+	bits defaults to numBits random bits per acquisition, the remaining
+	keyword arguments are passed through to synth_ask()
+	"""
+	def __init__(self, symRate=100, bits=None, numBits=64, seed=None,
+		**signal):
+		self.rng = np.random.RandomState(seed)
+		self.symRate = symRate
+		self.bits = bits
+		self.numBits = numBits
+		self.signal = signal
+		self.iqBandwidth = 40e6
+		self.recordLength = 1024
+		self.refLevel = 0
+		self.centerFreq = 1e9
+		self.trigLevel = -10
+		self.trigPosition = 0
+		self.running = False
+		self.iq = None
+		self.sentBits = None
+
+	def sampleRate(self):
+		rate = 56e6
+		while rate/2 >= self.iqBandwidth*1.4:
+			rate /= 2
+		return rate
+
+	def DEVICE_GetAPIVersion(self, apiVersion):
+		deref(apiVersion).value = 'SIM'
+		return 0
+
+	def DEVICE_Search(self, numFound, deviceIDs, deviceSerial, deviceType):
+		deref(numFound).value = 1
+		deviceIDs[0] = 0
+		deref(deviceSerial).value = 'SIM000'
+		deref(deviceType).value = 'RSA306 SIM'
+		return 0
+
+	def DEVICE_Connect(self, deviceID):
+		return 0
+
+	def DEVICE_Disconnect(self):
+		return 0
+
+	def DEVICE_GetSerialNumber(self, deviceSerial):
+		deref(deviceSerial).value = 'SIM000'
+		return 0
+
+	def DEVICE_GetNomenclature(self, deviceType):
+		deref(deviceType).value = 'RSA306 SIM'
+		return 0
+
+	def DEVICE_Run(self):
+		self.running = True
+		return 0
+
+	def DEVICE_Stop(self):
+		self.running = False
+		return 0
+
+	def CONFIG_Preset(self):
+		return 0
+
+	def CONFIG_SetReferenceLevel(self, refLevel):
+		self.refLevel = deref(refLevel).value
+		return 0
+
+	def CONFIG_SetCenterFreq(self, centerFreq):
+		self.centerFreq = deref(centerFreq).value
+		return 0
+
+	def IQBLK_SetIQBandwidth(self, iqBandwidth):
+		self.iqBandwidth = deref(iqBandwidth).value
+		return 0
+
+	def IQBLK_SetIQRecordLength(self, recordLength):
+		self.recordLength = deref(recordLength).value
+		return 0
+
+	def IQBLK_GetMinIQBandwidth(self, minBandwidth):
+		deref(minBandwidth).value = 100.0
+		return 0
+
+	def IQBLK_GetMaxIQBandwidth(self, maxBandwidth):
+		deref(maxBandwidth).value = 40e6
+		return 0
+
+	def IQBLK_GetMaxIQRecordLength(self, maxRecordLength):
+		deref(maxRecordLength).value = 126000000
+		return 0
+
+	def IQBLK_GetIQSampleRate(self, iqSampleRate):
+		deref(iqSampleRate).value = self.sampleRate()
+		return 0
+
+	def TRIG_SetTriggerMode(self, mode):
+		return 0
+
+	def TRIG_SetIFPowerTriggerLevel(self, trigLevel):
+		self.trigLevel = deref(trigLevel).value
+		return 0
+
+	def TRIG_SetTriggerSource(self, source):
+		return 0
+
+	def TRIG_SetTriggerPositionPercent(self, trigPosition):
+		self.trigPosition = deref(trigPosition).value
+		return 0
+
+	def IQBLK_AcquireIQData(self):
+		bits = self.bits
+		if bits is None:
+			bits = self.rng.randint(0, 2, self.numBits)
+		self.iq, start = synth_ask(bits, self.symRate, self.sampleRate(),
+			record_length=self.recordLength, trig_pos=self.trigPosition/100.0,
+			seed=self.rng.randint(2**31), **self.signal)
+		self.sentBits = bits
+		return 0
+
+	def IQBLK_WaitForIQDataReady(self, timeoutMsec, ready):
+		deref(ready).value = self.iq is not None
+		return 0
+
+	def IQBLK_GetIQDataDeinterleaved(self, iData, qData, actLength, reqLength):
+		length = min(deref(reqLength).value, len(self.iq))
+		np.ctypeslib.as_array(deref(iData))[:length] = self.iq.real[:length]
+		np.ctypeslib.as_array(deref(qData))[:length] = self.iq.imag[:length]
+		deref(actLength).value = length
+		return 0
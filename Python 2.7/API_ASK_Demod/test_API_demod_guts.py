@@ -0,0 +1,185 @@
+"""
+test_API_demod_guts.py
+Tests for ASK_demod_guts.py, run from this folder with
+python -m unittest test_API_demod_guts
+"""
+
+import time
+import unittest
+import numpy as np
+import ASK_demod_guts as guts
+from ASK_sim import SimRSA
+
+########################################################################
+#############################FUNCTIONS##################################
+########################################################################
+def loop_slicer(data, decPoint, startIndex, decOffset, saPerSym, validSym):
+	#the per-symbol loop ask_decode used before symbol_slicer
+	symTable = []
+	for i in range(validSym):
+		index = int(i*saPerSym+decOffset+startIndex)
+		if index >= len(data):
+			break
+		if data[index] >= decPoint:
+			symTable.append(1)
+		else:
+			symTable.append(0)
+	return np.array(symTable, dtype=np.uint8)
+
+def random_trace(rng, saPerSym, lead, numSym, noise=3):
+	#random symbols held for saPerSym samples after lead samples of idle
+	bits = rng.randint(0, 2, numSym)
+	bits[0] = 1
+	index = (np.arange(int(numSym*saPerSym))/saPerSym).astype(np.int64)
+	data = np.full(lead+len(index), -60.0)
+	data[lead:] = np.where(bits[index] == 1, -20.0, -60.0)
+	return data+rng.randn(len(data))*noise
+
+########################################################################
+###############################TESTS####################################
+########################################################################
+class SymbolSlicerTest(unittest.TestCase):
+	def test_matches_loop(self):
+		rng = np.random.RandomState(1)
+		for trial in range(200):
+			saPerSym = rng.uniform(2, 40)
+			data = random_trace(rng, saPerSym, rng.randint(0, 200),
+				rng.randint(8, 300))
+			startIndex = rng.randint(0, 200)
+			decOffset = int(saPerSym/2)
+			#ask for a few symbols past the end so they have to be trimmed
+			validSym = int(len(data)/saPerSym)+rng.randint(0, 4)
+			expected = loop_slicer(data, -40, startIndex, decOffset,
+				saPerSym, validSym)
+			symTable = guts.symbol_slicer(data, -40, startIndex, decOffset,
+				saPerSym, validSym)
+			self.assertEqual(symTable.dtype, np.uint8)
+			np.testing.assert_array_equal(symTable, expected)
+
+	def test_ask_decode_matches_loop(self):
+		rng = np.random.RandomState(2)
+		for trial in range(50):
+			saPerSym = rng.uniform(4, 40)
+			data = random_trace(rng, saPerSym, rng.randint(0, 200),
+				rng.randint(16, 300))
+			hi, lo = guts.hi_lo_calculator(data)
+			startIndex, decPoint = guts.firstedge_finder(data, hi, lo, 3)
+			decOffset = int(saPerSym/2)
+			validSym = (int(len(data)/saPerSym)-
+				int((startIndex+decOffset)/saPerSym))
+			expected = loop_slicer(data, decPoint, startIndex, decOffset,
+				saPerSym, validSym)
+			symTable, annotations = guts.ask_decode(data, 1., saPerSym, 3)
+			np.testing.assert_array_equal(symTable, expected)
+			self.assertEqual(annotations[3], len(expected))
+
+	def test_trims_past_end(self):
+		data = np.array([-20., -60., -20., -60., -20.])
+		symTable = guts.symbol_slicer(data, -40, 0, 0, 2, 10)
+		np.testing.assert_array_equal(symTable, [1, 1, 1])
+
+class LevelEstimatorTest(unittest.TestCase):
+	def test_zero_samples(self):
+		#exact zero IQ samples are -inf dBm
+		rng = np.random.RandomState(3)
+		bits = rng.randint(0, 2, 64)
+		bits[0] = 1
+		index = (np.arange(64*10)/10).astype(np.int64)
+		amplitude = np.concatenate((np.zeros(200), np.where(bits[index] == 1,
+			1.0, 0.01)*(1+0.01*rng.randn(len(index)))))
+		I = amplitude.astype(np.float32)
+		Q = np.zeros_like(I)
+		for linear in (False, True):
+			data = guts.iq_to_avt(I, Q, linear=linear)
+			symTable, annotations = guts.ask_decode(data, 1., 10., 3,
+				linear=linear)
+			np.testing.assert_array_equal(symTable[:64], bits)
+
+class PlanSetupTest(unittest.TestCase):
+	def test_record_covers_packet(self):
+		#symbol rates where the sample rate is 1.5x to 2.4x the bandwidth
+		for symRate in (100, 1e3, 3e3, 12345, 1e5, 7e5):
+			sim = SimRSA(symRate=symRate, seed=1)
+			guts.load_rsa(sim)
+			plan, summary = guts.plan_setup(1e9, 0, -10, symRate, 64)
+			self.assertEqual(plan['sampleRate'], sim.sampleRate())
+			self.assertEqual(sim.recordLength, plan['recordLength'])
+			self.assertGreaterEqual(plan['recordLength']/sim.sampleRate(),
+				64*1.25/symRate)
+			self.assertGreaterEqual(plan['saPerSym'], 16)
+
+	def test_demod_planned_packet(self):
+		sim = SimRSA(symRate=1e3, seed=1)
+		guts.load_rsa(sim)
+		plan, summary = guts.plan_setup(1e9, 0, -10, 1e3, 64)
+		I, Q = guts.acquire_iq(plan['recordLength'])
+		power, avtTime, Fs = guts.get_avt(I, Q, plan['recordLength'], linear=True)
+		symTable, annotations = guts.ask_decode(power, 1e3, Fs, 3, linear=True)
+		#the record starts on the packet, so the first edge may come late
+		first = int(round(annotations[1]*1e3/Fs))
+		np.testing.assert_array_equal(symTable[:64-first], sim.sentBits[first:])
+
+class ContinuousAcquisitionTest(unittest.TestCase):
+	def setUp(self):
+		self.sim = SimRSA(symRate=1e3, seed=1)
+		guts.load_rsa(self.sim)
+		self.plan, summary = guts.plan_setup(1e9, 0, -10, 1e3, 64)
+
+	def run_for(self, acquisition, seconds=0.2):
+		acquisition.start()
+		time.sleep(seconds)
+		acquisition.stop()
+
+	def test_restart(self):
+		lengths = []
+		def handler(I, Q, sampleRate):
+			lengths.append(len(I))
+			#slower than the acquisition so a filled block is left at stop()
+			time.sleep(0.05)
+		acquisition = guts.ContinuousAcquisition(self.plan['recordLength'],
+			handler)
+		self.run_for(acquisition)
+		first = acquisition.captures
+		self.assertGreater(first, 0)
+		#every buffer pair is back in the free pool
+		self.assertEqual(acquisition.free.qsize(), 2)
+		self.assertTrue(acquisition.filled.empty())
+		self.run_for(acquisition)
+		self.assertIsNone(acquisition.error)
+		self.assertGreater(acquisition.captures, first)
+		self.assertEqual(acquisition.free.qsize(), 2)
+		self.assertEqual(set(lengths), set([self.plan['recordLength']]))
+		self.assertFalse(self.sim.running)
+
+	def test_handler_error(self):
+		def handler(I, Q, sampleRate):
+			raise ValueError('bad block')
+		acquisition = guts.ContinuousAcquisition(self.plan['recordLength'],
+			handler)
+		acquisition.start()
+		acquisition.threads[1].join(2)
+		self.assertFalse(acquisition.threads[1].is_alive())
+		self.assertTrue(acquisition.stopEvent.is_set())
+		acquisition.stop()
+		self.assertIsInstance(acquisition.error, ValueError)
+		self.assertEqual(acquisition.captures, 1)
+		self.assertEqual(acquisition.free.qsize(), 2)
+
+	def test_acquire_error(self):
+		def fail(*args):
+			raise IOError('device lost')
+		self.sim.IQBLK_GetIQDataDeinterleaved = fail
+		acquisition = guts.ContinuousAcquisition(self.plan['recordLength'],
+			lambda I, Q, sampleRate: None)
+		acquisition.start()
+		#the demod thread is woken up and exits too
+		for thread in acquisition.threads:
+			thread.join(2)
+			self.assertFalse(thread.is_alive())
+		acquisition.stop()
+		self.assertIsInstance(acquisition.error, IOError)
+		self.assertEqual(acquisition.captures, 0)
+		self.assertEqual(acquisition.free.qsize(), 2)
+
+if __name__ == '__main__':
+	unittest.main()
@@ -16,6 +16,36 @@ import visa
 import numpy as np
 import matplotlib.pyplot as plt
 
+########################################################################
+##############################CLASSES###################################
+########################################################################
+class DecimatedTrace:
+	"""
+	Plots a min/max envelope decimated version of a long trace with
+	about two points per horizontal pixel, and re-decimates the visible
+	part whenever the x limits change (zoom/pan), so drawing cost does
+	not depend on the record length. x must be increasing.
+	"""
+	def __init__(self, ax, x, y, **kwargs):
+		self.ax = ax
+		self.x = np.asarray(x)
+		self.y = np.asarray(y)
+		self.line, = ax.plot([], [], **kwargs)
+		ax.set_xlim(self.x[0], self.x[-1])
+		margin = (np.amax(self.y)-np.amin(self.y))*0.05
+		ax.set_ylim(np.amin(self.y)-margin, np.amax(self.y)+margin)
+		self.update(ax)
+		#a plain function is held strongly by the callback registry
+		ax.callbacks.connect('xlim_changed', lambda ax: self.update(ax))
+
+	def update(self, ax):
+		xmin, xmax = ax.get_xlim()
+		start = max(np.searchsorted(self.x, xmin)-1, 0)
+		stop = min(np.searchsorted(self.x, xmax)+1, len(self.x))
+		pixels = max(int(ax.bbox.width), 100)
+		x, y = minmax_decimate(self.x[start:stop], self.y[start:stop], pixels)
+		self.line.set_data(x, y)
+
 ########################################################################
 #############################FUNCTIONS##################################
 ########################################################################
@@ -140,6 +170,28 @@ def ask_decode(data, sym_rate, samp_rate, thresh):
 	annotations = [d_point, start_index, dec_offset, valid_sym, sa_per_sym]
 	return sym_table, annotations
 
+def minmax_decimate(x, y, num_bins):
+	"""
+	This function splits y into num_bins bins and keeps only the
+	minimum and maximum sample of each (in time order), so the envelope
+	of the trace looks the same when drawn at num_bins pixels wide
+	"""
+	if len(y) <= 2*num_bins:
+		return x, y
+	per_bin = len(y)//num_bins
+	trimmed = per_bin*num_bins
+	binned = y[:trimmed].reshape(num_bins, per_bin)
+	offset = np.arange(num_bins)*per_bin
+	index = np.column_stack((np.argmin(binned, axis=1)+offset, 
+		np.argmax(binned, axis=1)+offset))
+	index = np.sort(index, axis=1).ravel()
+	if trimmed < len(y):
+		tail = np.arange(trimmed, len(y))
+		index = np.concatenate((index, 
+			[tail[np.argmin(y[tail])], tail[np.argmax(y[tail])]]))
+		index = np.sort(index)
+	return x[index], y[index]
+
 ########################################################################
 ########################################################################
 ########################################################################
@@ -213,12 +265,14 @@ def main():
 	symbol_table, annot = ask_decode(avt, sym_rate, Fs, thresh)
 	print('Symbol Table:\n{0}'.format(symbol_table))
 
-	#plot the data
-	plt.plot(avt_time, avt)
+	#plot the data, min/max decimated to the window width
+	trace = DecimatedTrace(plt.gca(), avt_time, avt)
 	plt.axhline(y=annot[0])
-	plt.axvline(x=avt_time[annot[1]])
-	for i in range(annot[3]):
-		plt.axvline(x=avt_time[annot[1]+annot[2]+annot[4]*i])
+	#all decision points as one collection instead of one line each
+	dec_index = (np.arange(annot[3])*annot[4]+annot[2]+annot[1]).astype(int)
+	dec_index = np.concatenate(([annot[1]], dec_index[dec_index < len(avt_time)]))
+	plt.vlines(avt_time[dec_index], 0, 1, 
+		transform=plt.gca().get_xaxis_transform())
 	plt.suptitle('Amplitude vs Time')
 	plt.ylabel('Amplitude (dBm)')
 	plt.xlabel('Time (s)')
@@ -11,7 +11,78 @@ ADD MANCHESTER FUNCTIONALITY, YOU GOT THE GUI FRAMEWORK DONE!
 """
 
 from Tkinter import *
+import Queue
+import threading
+import tkFileDialog
 from ASK_demod_guts import *
+from ASK_export import export_symbols, symbol_metadata
+
+#how often the GUI checks the workers for results, in ms
+POLL_INTERVAL = 50
+
+class Cancelled(Exception):
+	"""Raised inside a running job when the user cancels it"""
+	pass
+
+class Worker(threading.Thread):
+	"""
+	Background thread that runs jobs in the order they were submitted
+	and posts (name, kind, value) tuples to the results queue, where
+	kind is 'progress', 'done', 'error', or 'cancelled'. Jobs must not
+	touch Tk widgets, the GUI reads the results queue with after().
+	Long jobs call check() between their stages so cancel() can stop them.
+	"""
+	def __init__(self, results):
+		threading.Thread.__init__(self)
+		self.daemon = True
+		self.jobs = Queue.Queue()
+		self.results = results
+		self.pending = 0
+		#jobs are numbered as they are submitted, every job up to number
+		#cancelled is cancelled, current is the number of the running job
+		self.submitted = 0
+		self.cancelled = 0
+		self.current = 0
+
+	def submit(self, name, func, *args):
+		self.pending += 1
+		self.submitted += 1
+		self.jobs.put((self.submitted, name, func, args))
+
+	def check(self):
+		"""Raises Cancelled if the running job was cancelled"""
+		if self.current <= self.cancelled:
+			raise Cancelled
+
+	def progress(self, name):
+		"""Returns a progress callback for read_binblock() that also cancels"""
+		def callback(received, total):
+			self.check()
+			self.results.put((name, 'progress', float(received)/total))
+		return callback
+
+	def cancel(self):
+		#cancel everything submitted so far, the running job stops at its
+		#next check, jobs submitted after this still run
+		self.cancelled = self.submitted
+		while True:
+			try:
+				number, name, func, args = self.jobs.get_nowait()
+			except Queue.Empty:
+				break
+			self.results.put((name, 'cancelled', None))
+
+	def run(self):
+		while True:
+			self.current, name, func, args = self.jobs.get()
+			try:
+				#cancelled after it was taken off the queue
+				self.check()
+				self.results.put((name, 'done', func(*args)))
+			except Cancelled:
+				self.results.put((name, 'cancelled', None))
+			except Exception as error:
+				self.results.put((name, 'error', error))
 
 class GUI(Frame):
 	"""GUI with 8 text fields, 3 buttons, and a table"""
@@ -20,6 +91,14 @@ class GUI(Frame):
 		Frame.__init__(self,master)
 		self.grid()
 		self.createWidgets()
+		#instrument I/O and demod run on separate threads so a new
+		#acquisition can transfer while the previous one demodulates
+		self.results = Queue.Queue()
+		self.io_worker = Worker(self.results)
+		self.demod_worker = Worker(self.results)
+		self.io_worker.start()
+		self.demod_worker.start()
+		self.after(POLL_INTERVAL, self.poll_workers)
 
 	def createWidgets(self):
 		#Creating widgets in the GUI
@@ -118,22 +197,30 @@ class GUI(Frame):
 		self.replay_button.grid(column=1, row=active_row)
 		active_row += 1
 
-		#Row 9: Symbol rate label and entry
-		self.symratelabel = Label(self, text = 'Symbole Rate (Sym/sec)')
+		#Row 9: Symbol rate label, entry, and timing recovery checkbox
+		self.symratelabel = Label(self, text = 'Symbole Rate (Sym/sec or auto)')
 		self.symratelabel.grid(column=0, row=active_row, sticky=E)
 		self.symrate_e_text = StringVar()
 		self.symrate_e = Entry(self, textvariable=self.symrate_e_text)
 		self.symrate_e.grid(column=1, row=active_row)
 		self.symrate_e_text.set('250e3')
+		self.track_var = IntVar()
+		self.track_checkbox = Checkbutton(self, text='Track timing',
+			variable=self.track_var, onvalue=1, offvalue=0)
+		self.track_checkbox.grid(column=2, row=active_row)
 		active_row += 1
 
-		#Row 10: Demodulation Threshold label and entry
+		#Row 10: Demodulation Threshold label, entry, and integrate checkbox
 		self.threshlabel = Label(self, text = 'Demod Thresh (dB from peak)')
 		self.threshlabel.grid(column=0, row=active_row, sticky=E)
 		self.thresh_e_text = StringVar()
 		self.thresh_e = Entry(self, textvariable=self.thresh_e_text)
 		self.thresh_e.grid(column=1, row=active_row)
 		self.thresh_e_text.set('3')
+		self.integrate_var = IntVar()
+		self.integrate_checkbox = Checkbutton(self, text='Integrate symbols',
+			variable=self.integrate_var, onvalue=1, offvalue=0)
+		self.integrate_checkbox.grid(column=2, row=active_row)
 		active_row += 1
 
 		#Row 11: Status message, Manchester radio buttons, demodulate button
@@ -161,17 +248,20 @@ class GUI(Frame):
 		self.graph_button = Button(self, text='Demod Plot', 
 			command = self.gui_ask_plot, width=self.button_width)
 		self.graph_button.grid(column=0, row=active_row)
+		self.cancel_button = Button(self, text='Cancel',
+			command = self.gui_cancel, width=self.button_width)
+		self.cancel_button.grid(column=1, row=active_row)
 		# self.eye_diagram_button = Button(self, text='Eye Diagram',
 			# command = self.gui_eye_diagram, width=self.button_width)
 		active_row += 1
 
 
 	def inst_connect(self):
+		#*IDN? can wait out the VISA timeout, so connect on the I/O thread
 		self.status_text = 'Attemtping to connect...'
 		self.status_update()
 		descriptor = self.inst_list.get(ACTIVE)
-		self.inst, self.status_text = Tek_Instrument(descriptor)
-		self.status_update()
+		self.io_worker.submit('connect', Tek_Instrument, descriptor)
 
 	def gui_instrument_setup(self):
 		try:
@@ -180,85 +270,207 @@ class GUI(Frame):
 			reflevel = float(self.reflevel_e.get())
 			meas_length = float(self.meas_length_e.get())
 			trig_lvl = float(self.trig_lvl_e.get())
-			self.status_text = inst_setup(self.inst, 
+			self.io_worker.submit('setup', inst_setup, self.inst, 
 				cf, reflevel, span, meas_length, trig_lvl)
-			if self.status_text != 0:
-				self.status_update()
-			else:
-				self.status_text = 'Acquisition settings configured.'
+			self.status_text = 'Configuring acquisition...'
 		except ValueError:
 			self.status_text = 'Enter a valid number in each field.'
 		except AttributeError:
 			self.status_text = 'Please connect to an instrument.'
-		except visa.VisaIOError:
-			self.status_text = 'Timeout expired before operation completed.'
 		self.status_update()
 
+	def acquire_job(self, inst, progress):
+		acquire(inst)
+		return get_avt(inst, progress)
+
 	def gui_acquire(self):
 		try:
-			acquire(self.inst)
-			self.avt, self.Fs, self.plot_time, self.status_text = get_avt(self.inst)
-			if self.status_text != 0:
-				self.status_update()
-			else:
-				self.status_text = 'Data acquired, ready to demodulate.'
-		except ValueError:
-			self.status_text = 'Please enter valid numbers in all fields.'
+			self.io_worker.submit('acquire', self.acquire_job, self.inst,
+				self.io_worker.progress('acquire'))
+			self.button_update()
 		except AttributeError:
 			self.status_text = 'Please connect to an instrument.'
-		except visa.VisaIOError:
-			self.status_text = 'Timeout expired before operation completed.'
-		self.status_update()
+			self.status_update()
 
 	def gui_replay(self):
 		try:
-			self.avt, self.Fs, self.plot_time, self.status_text = get_avt(self.inst)
-			if self.status_text != 0:
-					self.status_update()
-			else:
-				self.status_text = 'Data updated, ready to demodulate.'
-		except ValueError:
-			self.status_text = 'Please enter valid numbers in all fields.'
+			self.io_worker.submit('replay', get_avt, self.inst,
+				self.io_worker.progress('replay'))
+			self.button_update()
 		except AttributeError:
 			self.status_text = 'Please connect to an instrument.'
-		except visa.VisaIOError:
-			self.status_text = 'Timeout expired before operation completed.'
-		self.status_update()
+			self.status_update()
+
+	def demod_job(self, avt, sym_rate, Fs, thresh, manchester, decision,
+		track):
+		#cancel takes effect between the levels, rate estimate, decode,
+		#and Manchester stages
+		check = self.demod_worker.check
+		rate_text = ''
+		if sym_rate is None:
+			#estimated rate is the chip rate for Manchester
+			sym_rate, confidence = sym_rate_estimator(avt, Fs, thresh)
+			if sym_rate is None:
+				raise ValueError('Too few edges to estimate the symbol rate.')
+			check()
+			data_rate = sym_rate
+			if manchester:
+				data_rate = sym_rate/2
+			rate_text = ('\nEstimated symbol rate: {0:.6g} sym/s\n'
+				'(confidence {1:.2f})'.format(data_rate, confidence))
+		symbol_table, annot = ask_decode(avt, sym_rate, Fs, thresh, decision,
+			track, check)
+		check()
+		status_text ='Demodulation complete.'
+		invalid_pairs = None
+		if manchester:
+			symbol_table, errors = manchester_decode(symbol_table)
+			invalid_pairs = len(errors)
+			status_text = 'Manchester demod complete.'
+			if len(errors) > 0:
+				status_text = ('Manchester demod complete,\n'
+					'{0} invalid symbol pairs skipped.'.format(len(errors)))
+		#sym_rate and annot are per chip for Manchester
+		meta = symbol_metadata(annot, Fs, sym_rate, manchester=manchester,
+			invalid_pairs=invalid_pairs)
+		if track:
+			#tracked symbol rate, in data symbols for Manchester
+			est_rate = Fs/annot[4]
+			if manchester:
+				est_rate = est_rate/2
+			meta['tracked_sym_rate'] = est_rate
+			status_text += '\nTracked symbol rate: {0:.6g} sym/s'.format(est_rate)
+		return symbol_table, annot, meta, status_text+rate_text
 
 	def gui_full_demod(self):
 		try:
-			sym_rate = float(self.symrate_e.get())
-			if self.manch_var.get() == 1:
-				sym_rate = sym_rate*2
-			if (sym_rate > 200e6) or (sym_rate < 0):
-				raise Warning
+			manchester = self.manch_var.get() == 1
+			#a blank or 'auto' symbol rate is estimated from the trace
+			sym_rate = self.symrate_e.get().strip()
+			if sym_rate.lower() in ('', 'auto'):
+				sym_rate = None
+			else:
+				sym_rate = float(sym_rate)
+				if manchester:
+					sym_rate = sym_rate*2
+				if (sym_rate > 200e6) or (sym_rate < 0):
+					raise Warning
 			thresh = float(self.thresh_e.get())
-			symbol_table, self.annot = ask_decode(self.avt, sym_rate, self.Fs, thresh)
-			self.status_text ='Demodulation complete.'
-			if self.manch_var.get() == 1:
-				symbol_table = manchester_ask_decode(symbol_table)
-				self.status_text = 'Manchester demod complete.'
-
-			self.st_contents = np.array_str(symbol_table, max_line_width=64)
-			self.symtable.itemconfig(self.symbol_table_text, 
-				text=self.st_contents)
+			decision = 'sample'
+			if self.integrate_var.get() == 1:
+				decision = 'integrate'
+			self.demod_worker.submit('demod', self.demod_job, self.avt, 
+				sym_rate, self.Fs, thresh, manchester, decision,
+				self.track_var.get() == 1)
+			self.button_update()
+			return
 		except ValueError:
 			self.status_text = 'Please enter valid numbers in all fields.'
 		except AttributeError:
 			self.status_text = 'Please acquire data before demodulating.'
 		except Warning:
 			self.status_text = 'Symbol rate out of range.'
-		except IndexError:
-			self.status_text = 'Pattern alignment or data rate error,\nplease reacquire data or adjust data rate.'
 		self.status_update()
 
+	def gui_cancel(self):
+		self.io_worker.cancel()
+		self.demod_worker.cancel()
+		self.status_text = 'Cancelling...'
+		self.status_update()
+
+	def poll_workers(self):
+		#handle everything the workers posted since the last poll
+		while True:
+			try:
+				name, kind, value = self.results.get_nowait()
+			except Queue.Empty:
+				break
+			if kind == 'progress':
+				self.button_update(name, value)
+				continue
+			if name == 'demod':
+				self.demod_worker.pending -= 1
+			else:
+				self.io_worker.pending -= 1
+			if kind == 'done':
+				self.job_done(name, value)
+			elif kind == 'cancelled':
+				self.status_text = 'Operation cancelled.'
+			else:
+				self.job_error(name, value)
+			self.button_update()
+			self.status_update()
+		self.after(POLL_INTERVAL, self.poll_workers)
+
+	def job_done(self, name, value):
+		if name == 'connect':
+			self.inst, self.status_text = value
+		elif name == 'setup':
+			self.status_text = value
+			if self.status_text == 0:
+				self.status_text = 'Acquisition settings configured.'
+		elif name in ('acquire', 'replay'):
+			self.avt, self.Fs, self.plot_time, self.status_text = value
+			if self.status_text == 0:
+				if name == 'acquire':
+					self.status_text = 'Data acquired, ready to demodulate.'
+				else:
+					self.status_text = 'Data updated, ready to demodulate.'
+		elif name == 'demod':
+			self.symbol_table, self.annot, self.meta, self.status_text = value
+			self.st_contents = np.array_str(self.symbol_table, max_line_width=64)
+			self.symtable.itemconfig(self.symbol_table_text, 
+				text=self.st_contents)
+
+	def job_error(self, name, error):
+		if isinstance(error, visa.VisaIOError):
+			self.status_text = 'Timeout expired before operation completed.'
+		elif isinstance(error, IndexError):
+			self.status_text = 'Pattern alignment or data rate error,\nplease reacquire data or adjust data rate.'
+		elif isinstance(error, AttributeError) and (name != 'demod'):
+			#self.inst is -1 after a failed connect
+			self.status_text = 'Please connect to an instrument.'
+		elif isinstance(error, ValueError) and (name == 'demod'):
+			#e.g. too few edges to estimate the symbol rate
+			self.status_text = str(error)
+		elif isinstance(error, ValueError):
+			self.status_text = 'Invalid data received, please reacquire.'
+		else:
+			self.status_text = '{0} failed: {1}'.format(name, error)
+
+	def button_update(self, name=None, fraction=None):
+		#show queued jobs and transfer progress on the buttons
+		io_text = 'Acquire'
+		if self.io_worker.pending > 0:
+			io_text = 'Acquire ({0} queued)'.format(self.io_worker.pending)
+		if (name in ('acquire', 'replay')) and (fraction is not None):
+			io_text = 'Acquire ({0:.0f}%)'.format(fraction*100)
+		self.acquire_button.configure(text=io_text)
+		demod_text = 'Demodulate'
+		if self.demod_worker.pending > 0:
+			demod_text = 'Demodulating...'
+		self.demod_button.configure(text=demod_text)
+
 	def export(self):
-		filename = 'ASK_symbol_table.txt'
-		output = open(filename, 'w')
-		output.write(self.st_contents)
-		output.close
-		self.status_text = 'Symbol table exported to {0}'.format(filename)
-		self.status_update()	
+		#full symbol table, not the truncated text shown in the window
+		try:
+			symbol_table = self.symbol_table
+		except AttributeError:
+			self.status_text = 'Please demodulate before exporting.'
+			self.status_update()
+			return
+		filename = tkFileDialog.asksaveasfilename(
+			initialfile='ASK_symbol_table.txt', defaultextension='.txt',
+			filetypes=[('Text', '*.txt'), ('Hex', '*.hex'),
+			('Packed binary', '*.bin'), ('NumPy archive', '*.npz')])
+		if not filename:
+			return
+		try:
+			export_symbols(filename, symbol_table, self.meta)
+			self.status_text = 'Symbol table exported to {0}'.format(filename)
+		except (IOError, ValueError) as error:
+			self.status_text = 'Export failed: {0}'.format(error)
+		self.status_update()
 
 	def gui_ask_plot(self):
 		axis = AskAxis()
@@ -284,4 +496,6 @@ app = GUI()
 
 app.master.title('ASK Demodulator v 0.7')
 
-app.mainloop()
\ No newline at end of file
+app.mainloop()
+#close the pooled VISA sessions
+visa_sessions.close()
@@ -0,0 +1,217 @@
+"""
+ASK_batch.py
+Headless batch demodulation of saved captures using ASK_demod_guts.py
+Takes one or more glob patterns of saved captures, demodulates each
+with ask_decode (and optionally Manchester) on a multiprocessing pool
+sized to the available cores, and writes one consolidated JSON results
+file with the symbols, levels, and timing of every capture, followed
+by throughput statistics.
+
+Supported capture files:
+.npz  with 'avt' (dBm) or 'iq' (complex) or 'I' and 'Q' arrays, and
+	  optionally 'Fs' (sample rate in Hz)
+.npy  a real AvT trace in dBm or a complex IQ array
+.tiq  SignalVu-PC IQ recordings
+other raw interleaved float32 or int16 IQ (--raw-dtype), --scaling
+	  converts the raw samples to volts
+.tiq and raw IQ files are memory-mapped and demodulated block by block
+(see ASK_tiq.py) so they can be larger than memory.
+Files without a stored sample rate need --samp-rate.
+
+Usage:
+python ASK_batch.py "captures/*.npz" -r 250e3 -o results.json
+python ASK_batch.py "captures/*.bin" -r 100e3 --samp-rate 56e6 --manchester
+python ASK_batch.py "captures/*.dat" -r 100e3 --samp-rate 56e6 --raw-dtype int16 --scaling 1.5e-5
+"""
+
+import argparse
+import glob
+import json
+import multiprocessing
+import os
+import sys
+from timeit import default_timer
+import numpy as np
+from ASK_demod_guts import *
+from ASK_tiq import open_recording, demod_recording
+
+#AskDemodulator for each setting used in this (worker) process
+DEMODULATORS = {}
+#sample types of raw IQ files
+RAW_DTYPES = {'float32': np.float32, 'int16': np.int16}
+
+########################################################################
+#############################FUNCTIONS##################################
+########################################################################
+def load_capture(path, samp_rate=None):
+	"""
+	This function loads a saved capture and returns the AvT trace in dBm
+	and its sample rate. samp_rate overrides the stored sample rate.
+	"""
+	extension = os.path.splitext(path)[1].lower()
+	Fs = None
+	if extension == '.npz':
+		saved = np.load(path)
+		if 'avt' in saved:
+			avt = saved['avt']
+		elif 'iq' in saved:
+			avt = iq_to_avt(saved['iq'].real, saved['iq'].imag)
+		else:
+			avt = iq_to_avt(saved['I'], saved['Q'])
+		if 'Fs' in saved:
+			Fs = float(saved['Fs'])
+	elif extension == '.npy':
+		data = np.load(path)
+		if np.iscomplexobj(data):
+			avt = iq_to_avt(data.real, data.imag)
+		else:
+			avt = data
+	else:
+		raise ValueError('{0} is not a .npz or .npy capture.'.format(path))
+	if samp_rate is not None:
+		Fs = samp_rate
+	if Fs is None:
+		raise ValueError('No sample rate stored in {0}, use --samp-rate.'.format(path))
+	return avt, Fs
+
+def get_demodulator(samp_rate, sym_rate, thresh):
+	#same-setting captures reuse the cached decision index templates
+	key = (samp_rate, sym_rate, thresh)
+	if key not in DEMODULATORS:
+		DEMODULATORS[key] = AskDemodulator(samp_rate, sym_rate, thresh)
+	return DEMODULATORS[key]
+
+def symbol_string(sym_table):
+	#'0'/'1' text of a symbol table without a per-symbol Python loop
+	return (np.asarray(sym_table, dtype=np.uint8)+ord('0')).tostring()
+
+def demod_capture(job):
+	"""
+	This function demodulates one capture and returns a result dict.
+	Errors are reported in the result instead of raised so one bad
+	file does not stop the batch. Runs in the pool worker processes.
+	"""
+	path, sym_rate, thresh, manchester, samp_rate, raw_dtype, scaling = job
+	result = {'file': path}
+	try:
+		chip_rate = sym_rate
+		if manchester:
+			chip_rate = sym_rate*2
+		start = default_timer()
+		if os.path.splitext(path)[1].lower() in ('.npz', '.npy'):
+			avt, Fs = load_capture(path, samp_rate)
+			loaded = default_timer()
+			demodulator = get_demodulator(Fs, chip_rate, thresh)
+			sym_table, annot = demodulator.demod(avt)
+			hi, lo, confidence = demodulator.levels
+			samples = len(avt)
+			d_point, start_index = annot[0], annot[1]
+		else:
+			recording = open_recording(path, samp_rate, RAW_DTYPES[raw_dtype],
+				scaling)
+			loaded = default_timer()
+			sym_table, demod = demod_recording(recording, chip_rate, thresh)
+			Fs, samples = recording.samp_rate, len(recording)
+			hi, lo, confidence = demod.hi, demod.lo, demod.confidence
+			d_point, start_index = demod.d_point, demod.start_index
+		result.update({'samp_rate': Fs, 'samples': samples,
+			'hi': float(hi), 'lo': float(lo),
+			'separability': float(confidence['separability']),
+			'd_point': float(d_point), 
+			'start_index': int(start_index) if start_index is not None else None,
+			'symbols': symbol_string(sym_table)})
+		if manchester:
+			manch_table, errors = manchester_decode(sym_table)
+			result['manchester'] = symbol_string(manch_table)
+			result['invalid_pairs'] = errors.tolist()
+		done = default_timer()
+		result.update({'load_time': loaded-start, 'demod_time': done-loaded})
+	except Exception as error:
+		result['error'] = '{0}: {1}'.format(type(error).__name__, error)
+	return result
+
+def find_captures(patterns):
+	paths = []
+	for pattern in patterns:
+		paths.extend(sorted(glob.glob(pattern)))
+	return paths
+
+def run_batch(paths, sym_rate, thresh, manchester=False, samp_rate=None,
+	processes=None, raw_dtype='float32', scaling=1.0):
+	"""
+	This function demodulates every capture in paths on a process pool
+	(one process per core by default) and returns the list of results
+	in the same order, plus a summary dict of throughput statistics
+	raw_dtype ('float32' or 'int16') and scaling (volts per unit) are
+	for raw IQ files
+	"""
+	jobs = [(path, sym_rate, thresh, manchester, samp_rate, raw_dtype, scaling)
+		for path in paths]
+	start = default_timer()
+	if processes == 1:
+		results = map(demod_capture, jobs)
+	else:
+		pool = multiprocessing.Pool(processes)
+		try:
+			results = pool.map(demod_capture, jobs, chunksize=1)
+		finally:
+			pool.close()
+			pool.join()
+	elapsed = default_timer()-start
+
+	good = [result for result in results if 'error' not in result]
+	samples = sum(result['samples'] for result in good)
+	symbols = sum(len(result['symbols']) for result in good)
+	summary = {'captures': len(results), 'failed': len(results)-len(good),
+		'wall_time': elapsed,
+		'processes': processes or multiprocessing.cpu_count(),
+		'captures_per_sec': len(results)/max(elapsed, 1e-9),
+		'samples_per_sec': samples/max(elapsed, 1e-9),
+		'symbols_per_sec': symbols/max(elapsed, 1e-9)}
+	return results, summary
+
+########################################################################
+########################################################################
+########################################################################
+
+def main(argv=None):
+	parser = argparse.ArgumentParser(description='Batch ASK demodulation')
+	parser.add_argument('patterns', nargs='+', help='capture file glob patterns')
+	parser.add_argument('-r', '--sym-rate', type=float, required=True,
+		help='symbol (data) rate in sym/sec')
+	parser.add_argument('-t', '--thresh', type=float, default=3,
+		help='decision threshold in dB from peak')
+	parser.add_argument('-m', '--manchester', action='store_true')
+	parser.add_argument('--samp-rate', type=float,
+		help='sample rate for files that do not store one')
+	parser.add_argument('--raw-dtype', choices=sorted(RAW_DTYPES),
+		default='float32', help='sample type of raw interleaved IQ files')
+	parser.add_argument('--scaling', type=float, default=1.0,
+		help='volts per unit of raw IQ samples')
+	parser.add_argument('-j', '--processes', type=int,
+		help='worker processes, defaults to the number of cores')
+	parser.add_argument('-o', '--output', default='ASK_batch_results.json')
+	args = parser.parse_args(argv)
+
+	paths = find_captures(args.patterns)
+	if not paths:
+		print('No captures match {0}'.format(' '.join(args.patterns)))
+		return 1
+	results, summary = run_batch(paths, args.sym_rate, args.thresh,
+		args.manchester, args.samp_rate, args.processes, args.raw_dtype,
+		args.scaling)
+	with open(args.output, 'w') as output:
+		json.dump({'results': results, 'summary': summary}, output, indent=1)
+
+	for result in results:
+		if 'error' in result:
+			print('{0}: {1}'.format(result['file'], result['error']))
+	print('Demodulated {captures} captures ({failed} failed) in {wall_time:.3f} s '
+		'on {processes} processes'.format(**summary))
+	print('{captures_per_sec:.2f} captures/s, {samples_per_sec:.4g} Sa/s, '
+		'{symbols_per_sec:.4g} sym/s'.format(**summary))
+	print('Results saved to {0}'.format(args.output))
+	return 0
+
+if __name__ == '__main__':
+	sys.exit(main())
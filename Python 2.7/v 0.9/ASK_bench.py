@@ -0,0 +1,227 @@
+"""
+ASK_bench.py
+Benchmark harness for ASK_demod_guts.py
+Sweeps record length, samples per symbol, and SNR over synthetic
+Manchester bursts from the simulated instrument (ASK_sim.py) and times
+each pipeline stage: get_avt, hi_lo_calculator, firstedge_finder,
+ask_decode, and manchester_ask_decode. Reports wall time, throughput,
+and peak memory per stage, saves the results as JSON, and can compare
+against a saved baseline and fail on regressions.
+
+Usage:
+python ASK_bench.py -o bench.json
+python ASK_bench.py -b bench.json --tolerance 0.25
+"""
+
+import argparse
+import ctypes
+import ctypes.util
+import json
+import os
+import sys
+from timeit import default_timer
+import numpy as np
+from ASK_demod_guts import *
+
+try:
+	import tracemalloc
+except ImportError:
+	tracemalloc = None
+try:
+	libc = ctypes.CDLL(ctypes.util.find_library('c'))
+	libc.malloc_trim
+except (OSError, AttributeError, TypeError):
+	libc = None
+
+SAMP_RATE = 56e6
+THRESH = 3
+HI_LEVEL = -10
+
+########################################################################
+#############################FUNCTIONS##################################
+########################################################################
+def make_fixture(record_length, sa_per_sym, snr, seed=0):
+	"""
+	This function returns a simulated instrument loaded with a
+	Manchester burst that fills 90% of record_length samples at
+	sa_per_sym samples per chip and snr dB above the noise floor
+	"""
+	chip_rate = SAMP_RATE/sa_per_sym
+	num_bits = max(int(0.9*record_length/sa_per_sym/2), 2)
+	inst = SimInstrument(sym_rate=chip_rate/2, num_bits=num_bits, seed=seed,
+		coding='manchester', hi_level=HI_LEVEL, lo_level=HI_LEVEL-40,
+		noise_level=HI_LEVEL-snr)
+	inst.span = SAMP_RATE/1.4
+	inst.meas_time = record_length/SAMP_RATE
+	acquire(inst)
+	return inst
+
+def proc_status(field):
+	#a memory field of /proc/self/status (VmRSS, VmHWM...) in bytes
+	with open('/proc/self/status') as status:
+		for line in status:
+			if line.startswith(field+':'):
+				return int(line.split()[1])*1024
+	raise IOError('{0} not in /proc/self/status'.format(field))
+
+def peak_memory(func):
+	"""
+	This function returns the peak memory in bytes allocated by one run
+	of func. tracemalloc measures it where it exists (Python 3). On
+	Linux the free heap is handed back to the OS, the resident size high
+	water mark (VmHWM) is reset through /proc/self/clear_refs, and the
+	growth of the high water mark over the resident size is returned.
+	ru_maxrss can't be used, it is a high water mark for the life of the
+	process, so every stage after the largest one would show 0.
+	Returns None where neither is available (e.g. Python 2 on Windows).
+	"""
+	if tracemalloc is not None:
+		tracemalloc.start()
+		try:
+			func()
+			current, peak = tracemalloc.get_traced_memory()
+		finally:
+			tracemalloc.stop()
+		return peak
+	if not os.path.exists('/proc/self/clear_refs'):
+		return None
+	if libc is not None:
+		#freed blocks still resident would hide new allocations
+		libc.malloc_trim(0)
+	try:
+		with open('/proc/self/clear_refs', 'w') as clear_refs:
+			clear_refs.write('5')
+		before = proc_status('VmRSS')
+		func()
+		return proc_status('VmHWM')-before
+	except (IOError, ValueError):
+		return None
+
+def time_stage(func, repeats):
+	"""
+	This function runs func repeats times and returns the last result,
+	the best wall time in seconds, and the peak memory of one run
+	"""
+	peak = peak_memory(func)
+	result = func()
+	best = None
+	for i in range(repeats):
+		start = default_timer()
+		result = func()
+		elapsed = default_timer()-start
+		if (best is None) or (elapsed < best):
+			best = elapsed
+	return result, best, peak
+
+def run_config(record_length, sa_per_sym, snr, repeats=3):
+	"""This function times every stage for one point of the sweep"""
+	inst = make_fixture(record_length, sa_per_sym, snr)
+	config = {'record_length': record_length, 'sa_per_sym': sa_per_sym,
+		'snr': snr}
+	results = []
+
+	def record(stage, func, samples, symbols):
+		output, elapsed, peak = time_stage(func, repeats)
+		entry = dict(config)
+		rate_time = max(elapsed, 1e-9)
+		entry.update({'stage': stage, 'time': elapsed, 'peak_memory': peak,
+			'samples_per_sec': samples/rate_time,
+			'symbols_per_sec': symbols/rate_time})
+		results.append(entry)
+		return output
+
+	def fetch():
+		return get_avt(inst)
+
+	avt, Fs, acq_time, status_text = fetch()
+	num_sym = len(avt)/float(sa_per_sym)
+	chip_rate = Fs/sa_per_sym
+	record('get_avt', fetch, len(avt), num_sym)
+	hi, lo = record('hi_lo_calculator', lambda: hi_lo_calculator(avt),
+		len(avt), num_sym)
+	record('firstedge_finder', lambda: firstedge_finder(avt, hi, lo, THRESH),
+		len(avt), num_sym)
+	sym_table, annot = record('ask_decode',
+		lambda: ask_decode(avt, chip_rate, Fs, THRESH), len(avt), num_sym)
+	record('manchester_ask_decode', lambda: manchester_ask_decode(sym_table),
+		len(sym_table), len(sym_table))
+	return results
+
+def run_sweep(record_lengths, sa_per_syms, snrs, repeats=3, verbose=True):
+	results = []
+	for record_length in record_lengths:
+		for sa_per_sym in sa_per_syms:
+			for snr in snrs:
+				for entry in run_config(record_length, sa_per_sym, snr, repeats):
+					results.append(entry)
+					if verbose:
+						print_entry(entry)
+	return results
+
+def print_entry(entry):
+	peak = entry['peak_memory']
+	peak = '{0:8.1f} MB'.format(peak/1e6) if peak is not None else '     n/a'
+	print('{stage:>22} N={record_length:<9} sps={sa_per_sym:<6} snr={snr:<4} '
+		'{time:9.6f} s {samples_per_sec:12.4g} Sa/s '
+		'{symbols_per_sec:12.4g} sym/s'.format(**entry) + ' ' + peak)
+
+def result_key(entry):
+	return (entry['stage'], entry['record_length'], entry['sa_per_sym'],
+		entry['snr'])
+
+def compare(results, baseline, tolerance):
+	"""
+	This function compares stage times against a baseline and returns a
+	list of (entry, baseline_time) for every stage that is more than
+	tolerance (fractional) slower than the baseline
+	"""
+	saved = dict((result_key(entry), entry) for entry in baseline)
+	regressions = []
+	for entry in results:
+		old = saved.get(result_key(entry))
+		if old is None:
+			continue
+		if entry['time'] > old['time']*(1+tolerance):
+			regressions.append((entry, old['time']))
+	return regressions
+
+########################################################################
+########################################################################
+########################################################################
+
+def main(argv=None):
+	parser = argparse.ArgumentParser(description='ASK demod pipeline benchmark')
+	parser.add_argument('-n', '--record-lengths', type=int, nargs='+',
+		default=[100000, 1000000, 4000000])
+	parser.add_argument('-s', '--sa-per-sym', type=float, nargs='+',
+		default=[8, 64, 512])
+	parser.add_argument('--snr', type=float, nargs='+', default=[10, 20, 40])
+	parser.add_argument('-r', '--repeats', type=int, default=3)
+	parser.add_argument('-o', '--output', help='save results to this JSON file')
+	parser.add_argument('-b', '--baseline', help='JSON results to compare against')
+	parser.add_argument('-t', '--tolerance', type=float, default=0.2,
+		help='allowed fractional slowdown against the baseline')
+	args = parser.parse_args(argv)
+
+	results = run_sweep(args.record_lengths, args.sa_per_sym, args.snr,
+		args.repeats)
+	if args.output:
+		with open(args.output, 'w') as output:
+			json.dump(results, output, indent=1)
+		print('Results saved to {0}'.format(args.output))
+
+	if args.baseline:
+		with open(args.baseline) as saved:
+			baseline = json.load(saved)
+		regressions = compare(results, baseline, args.tolerance)
+		for entry, old_time in regressions:
+			print('REGRESSION {stage} N={record_length} sps={sa_per_sym} '
+				'snr={snr}: {time:.6f} s'.format(**entry) +
+				' vs {0:.6f} s baseline'.format(old_time))
+		if regressions:
+			return 1
+		print('No regressions against {0}'.format(args.baseline))
+	return 0
+
+if __name__ == '__main__':
+	sys.exit(main())
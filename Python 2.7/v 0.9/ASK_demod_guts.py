@@ -16,17 +16,142 @@ adjust acquisition parameters, symbol rate, and decision threshold.
 """
 TODO:
 Create instrument class with basic parameters as class members
-Create class for ASK_demod_guts to remove function argument clutter
 """
 
+import collections
+import multiprocessing
+import threading
+import time
 import visa
 import numpy as np
 import matplotlib.pyplot as plt
+from ASK_sim import SimInstrument, SIM_DESCRIPTOR
+
+#records at least this long have their bursts demodulated on a process pool
+PARALLEL_SAMPLES = 4000000
 
 ########################################################################
 ##############################CLASSES###################################
 ########################################################################
 
+class VisaSessionManager:
+	"""
+	Keeps one VISA ResourceManager and a pool of open instrument sessions
+	keyed by descriptor, so connecting, acquiring, and replaying reuse the
+	same session instead of loading the VISA library, rescanning, and
+	opening a new session each time. Descriptors starting with 'SIM' are
+	pooled SimInstruments (see ASK_sim.py).
+	check() only sends *IDN? when the session has been idle for more than
+	health_interval seconds, and reconnect() replaces a session that
+	stopped answering. Safe to use from the GUI worker threads.
+	"""
+	def __init__(self, health_interval=10):
+		self.health_interval = health_interval
+		self.rm = None
+		self.sessions = {}
+		self.last_used = {}
+		self.id_strings = {}
+		self.lock = threading.RLock()
+
+	def resource_manager(self):
+		#the VISA library is only loaded the first time it is needed
+		with self.lock:
+			if self.rm is None:
+				self.rm = visa.ResourceManager()
+			return self.rm
+
+	def list_resources(self):
+		return tuple(self.resource_manager().list_resources())
+
+	def instrument(self, descriptor):
+		"""Returns the pooled session for descriptor, opening it if needed"""
+		with self.lock:
+			instrument = self.sessions.get(descriptor)
+			if instrument is None:
+				if descriptor.upper().startswith('SIM'):
+					instrument = SimInstrument()
+				else:
+					instrument = self.resource_manager().open_resource(descriptor)
+				self.sessions[descriptor] = instrument
+			self.last_used[descriptor] = time.time()
+			return instrument
+
+	def check(self, descriptor):
+		"""
+		Returns the *IDN? string of descriptor, querying it (and
+		reconnecting once if that fails) only if the session is new or
+		has been idle for more than health_interval seconds
+		"""
+		with self.lock:
+			idle = time.time()-self.last_used.get(descriptor, 0)
+			if ((descriptor in self.sessions) and (descriptor in self.id_strings)
+				and (idle <= self.health_interval)):
+				return self.id_strings[descriptor]
+			try:
+				id_string = self.instrument(descriptor).ask('*IDN?')
+			except visa.VisaIOError:
+				id_string = self.reconnect(descriptor).ask('*IDN?')
+			self.id_strings[descriptor] = id_string
+			return id_string
+
+	def reconnect(self, descriptor):
+		"""Closes the session for descriptor and opens a new one"""
+		with self.lock:
+			self.close(descriptor)
+			return self.instrument(descriptor)
+
+	def close(self, descriptor=None):
+		"""Closes one pooled session, or all of them"""
+		with self.lock:
+			if descriptor is None:
+				descriptors = list(self.sessions)
+			else:
+				descriptors = [descriptor]
+			for name in descriptors:
+				instrument = self.sessions.pop(name, None)
+				self.id_strings.pop(name, None)
+				self.last_used.pop(name, None)
+				if instrument is not None:
+					try:
+						instrument.close()
+					except visa.VisaIOError:
+						pass
+
+class InstrumentSession:
+	"""
+	Instrument handle returned by Tek_Instrument, used like a PyVISA
+	instrument. Every call goes to the current pooled session, and a
+	write or query that fails with a VISA error (e.g. a timeout) is
+	retried once on a fresh session. Binary block reads through visalib
+	are not retried since they can't be resumed part way.
+	"""
+	def __init__(self, manager, descriptor):
+		self.manager = manager
+		self.descriptor = descriptor
+
+	def retry(self, method, *args):
+		try:
+			return getattr(self.manager.instrument(self.descriptor), method)(*args)
+		except visa.VisaIOError:
+			instrument = self.manager.reconnect(self.descriptor)
+			return getattr(instrument, method)(*args)
+
+	def write(self, command):
+		return self.retry('write', command)
+
+	def ask(self, command):
+		return self.retry('ask', command)
+
+	def query(self, command):
+		return self.retry('query', command)
+
+	def close(self):
+		self.manager.close(self.descriptor)
+
+	def __getattr__(self, name):
+		#visalib, session, read_raw, timeout, etc. of the current session
+		return getattr(self.manager.instrument(self.descriptor), name)
+
 class AskAxis:
 	def __init__(self):
 		self.annot = []
@@ -37,28 +162,214 @@ class AskAxis:
 	def calcx(self):
 		self.x = np.linspace(0,self.time, len(self.y))
 
+class DecimatedTrace:
+	"""
+	Plots a min/max envelope decimated version of a long trace with
+	about two points per horizontal pixel, and re-decimates the visible
+	part whenever the x limits change (zoom/pan), so drawing cost does
+	not depend on the record length. x must be increasing.
+	"""
+	def __init__(self, ax, x, y, **kwargs):
+		self.ax = ax
+		self.x = np.asarray(x)
+		self.y = np.asarray(y)
+		self.line, = ax.plot([], [], **kwargs)
+		ax.set_xlim(self.x[0], self.x[-1])
+		margin = (np.amax(self.y)-np.amin(self.y))*0.05
+		ax.set_ylim(np.amin(self.y)-margin, np.amax(self.y)+margin)
+		self.update(ax)
+		#a plain function is held strongly by the callback registry
+		ax.callbacks.connect('xlim_changed', lambda ax: self.update(ax))
+
+	def update(self, ax):
+		xmin, xmax = ax.get_xlim()
+		start = max(np.searchsorted(self.x, xmin)-1, 0)
+		stop = min(np.searchsorted(self.x, xmax)+1, len(self.x))
+		pixels = max(int(ax.bbox.width), 100)
+		x, y = minmax_decimate(self.x[start:stop], self.y[start:stop], pixels)
+		self.line.set_data(x, y)
+
+class AskStreamDemod:
+	"""
+	Stateful ASK demodulator that consumes the AvT trace (or raw IQ) one
+	block at a time. The decision threshold, first edge, and symbol
+	phase are carried across block boundaries so records of any length
+	can be demodulated with bounded memory.
+	If hi is not given, the hi/lo levels are estimated from the first
+	block handed to process().
+	"""
+	def __init__(self, sym_rate, samp_rate, thresh, hi=None):
+		self.sa_per_sym = float(samp_rate)/sym_rate
+		self.dec_offset = int(self.sa_per_sym/2)
+		self.thresh = thresh
+		self.hi = hi
+		self.d_point = None
+		if hi is not None:
+			self.d_point = hi-thresh
+		self.reset()
+
+	def reset(self):
+		#forget stream position and symbol phase, keep the threshold
+		self.position = 0
+		self.start_index = None
+		self.sym_count = 0
+		self.last_sample = None
+
+	def process(self, block):
+		"""Demods one AvT block and returns the symbols it completes"""
+		block = np.asarray(block)
+		block_start = self.position
+		self.position += len(block)
+		if len(block) == 0:
+			return np.zeros(0, dtype=np.uint8)
+		if self.d_point is None:
+			self.hi, lo = hi_lo_calculator(block)
+			self.d_point = self.hi-self.thresh
+
+		if self.start_index is None:
+			#look for the first rising edge, including the one that
+			#straddles the previous block boundary
+			below = block <= self.d_point
+			rising = np.flatnonzero(below[:-1] & ~below[1:]) + 1
+			if (self.last_sample is not None and 
+				self.last_sample <= self.d_point and not below[0]):
+				rising = np.insert(rising, 0, 0)
+			self.last_sample = block[-1]
+			if len(rising) == 0:
+				return np.zeros(0, dtype=np.uint8)
+			self.start_index = block_start + rising[0]
+
+		#every decision point that lands inside this block
+		first = self.start_index+self.dec_offset
+		last_sym = int(np.ceil((self.position-first)/self.sa_per_sym))
+		symbols = np.arange(self.sym_count, max(last_sym, self.sym_count))
+		index = (symbols*self.sa_per_sym+first).astype(np.int64)
+		index = index[index < self.position] - block_start
+		self.sym_count += len(index)
+		return (block[index] >= self.d_point).astype(np.uint8)
+
+	def process_iq(self, I, Q):
+		"""Converts one IQ block to AvT and demods it"""
+		return self.process(iq_to_avt(I, Q))
+
+	def demod_blocks(self, blocks):
+		"""Generator that yields the symbol array for each AvT block"""
+		for block in blocks:
+			yield self.process(block)
+
+class AskDemodulator:
+	"""
+	Reusable ASK demodulator for repeated captures with the same settings
+	Holds the sample rate, symbol (data) rate, decision threshold, line
+	coding ('ask', 'manchester', or 'differential'), and decision mode
+	('sample' or 'integrate', window is the integrated fraction of each
+	symbol), and caches the decision index templates
+	for each record length it sees (the cache_size most recently used
+	lengths are kept), so demod() of another record of the same length
+	only has to estimate the levels, find the first edge, and slice.
+	If hi is given the level estimate is skipped too and the decision
+	point is hi-thresh. demod() returns the same symbol table and
+	annotations as ask_decode (then Manchester decoded if selected),
+	the invalid Manchester pairs are left in errors and the hi level,
+	lo level, and level confidence (see level_estimator) in levels (lo
+	and confidence are None if hi was given).
+	"""
+	def __init__(self, samp_rate, sym_rate, thresh, coding='ask', 
+		decision='sample', hi=None, window=0.8, cache_size=8):
+		if coding not in ('ask', 'manchester', 'differential'):
+			raise ValueError('Unknown line coding: {0}'.format(coding))
+		if decision not in ('sample', 'integrate'):
+			raise ValueError('Unknown decision mode: {0}'.format(decision))
+		self.samp_rate = samp_rate
+		self.sym_rate = sym_rate
+		self.thresh = thresh
+		self.coding = coding
+		self.decision = decision
+		self.hi = hi
+		self.window = window
+		self.cache_size = cache_size
+		self.chip_rate = sym_rate
+		if coding != 'ask':
+			self.chip_rate = sym_rate*2
+		self.sa_per_sym = float(samp_rate)/self.chip_rate
+		self.dec_offset = int(self.sa_per_sym/2)
+		self.templates = collections.OrderedDict()
+		self.errors = np.zeros(0, dtype=np.int64)
+		self.levels = None
+
+	def template(self, record_length):
+		"""
+		Returns the decision indices (or the symbol starts handed to
+		symbol_means for integrate) of a record of record_length samples
+		for a first edge at sample 0, shifting them by the first edge
+		gives the same indices as symbol_slicer and integrate_slicer
+		"""
+		template = self.templates.pop(record_length, None)
+		if template is None:
+			num_sym = int(record_length/self.sa_per_sym)
+			template = np.arange(num_sym)*self.sa_per_sym
+			if self.decision == 'sample':
+				template = (template+self.dec_offset).astype(np.int64)
+			if len(self.templates) >= self.cache_size:
+				self.templates.popitem(last=False)
+		self.templates[record_length] = template
+		return template
+
+	def demod(self, avt):
+		"""Demods one AvT trace, see the class docstring"""
+		data = np.asarray(avt)
+		if self.hi is None:
+			hi, lo, confidence = level_estimator(data)
+		else:
+			hi, lo, confidence = self.hi, None, None
+		self.levels = (hi, lo, confidence)
+		start_index, d_point = firstedge_finder(data, hi, lo, self.thresh)
+		num_sym = int(len(data)/self.sa_per_sym)
+		valid_sym = num_sym - int((start_index+self.dec_offset)/self.sa_per_sym)
+		template = self.template(len(data))
+		if self.decision == 'integrate':
+			symbols = template[:max(valid_sym, 0)]+start_index
+			means = symbol_means(data, symbols, self.sa_per_sym, self.window)
+			sym_table = (means >= d_point).astype(np.uint8)
+		else:
+			index = template[:max(valid_sym, 0)]+start_index
+			index = index[index < len(data)]
+			sym_table = (data[index] >= d_point).astype(np.uint8)
+		annot = [d_point, start_index, self.dec_offset, len(sym_table),
+			self.sa_per_sym]
+		if self.coding != 'ask':
+			sym_table, self.errors = manchester_decode(sym_table,
+				self.coding == 'differential')
+		return sym_table, annot
+
+#shared VISA resource manager and session pool
+visa_sessions = VisaSessionManager()
+
 ########################################################################
 #############################FUNCTIONS##################################
 ########################################################################
 def VISA_search():
 	"""This function searches the VISA resource manager for instruments"""
 	try:
-		rm = visa.ResourceManager()
+		inst_list = visa_sessions.list_resources()
 	except visa.VisaIOError:
 		raw_input('VISA Error. Please ensure TekVISA is installed correctly.')
 		exit()
-	inst_list = rm.list_resources()
+	#the simulated instrument is always available, see ASK_sim.py
+	inst_list = tuple(inst_list) + (SIM_DESCRIPTOR,)
 	return inst_list
 
 def Tek_Instrument(descriptor):
-	"""This function creates a visa instrument object"""
+	"""
+	This function returns an instrument session from the visa_sessions
+	pool, reusing the open session if there is one (see InstrumentSession)
+	Descriptors starting with 'SIM' connect to the simulated instrument
+	in ASK_sim.py instead of going through VISA
+	"""
 	try:
-		rm = visa.ResourceManager()
-		instrument = rm.open_resource(descriptor)
-		#instrument.timeout = 10
-		id_string = instrument.ask('*IDN?')
+		id_string = visa_sessions.check(descriptor)
+		instrument = InstrumentSession(visa_sessions, descriptor)
 		status_text = ('Connected to:\n{0}'.format(id_string))
-		#instrument.timeout = timeout
 		return instrument, status_text
 	except visa.VisaIOError:
 		status_text = 'Selected device not found.'
@@ -117,50 +428,215 @@ def binblock_parser(rawdata,data_type):
 	#determine the length of the header by adding 2 to the number of
 	#digits in the waveform length (one for the # character and one 
 	#for the character being read)
-	headerlength = 2 + int(rawdata[1])
-	#print(rawdata[0:10])
-	bytes = int(rawdata[2:headerlength])
-	bytes_per_pt = int(str(data_type)[-4:-2])/8
+	#a '#0' header is an indefinite length block that runs to the end
+	#of the message
+	if rawdata[0:1] != b'#':
+		raise ValueError('Binary block header not found.')
+	digits = int(rawdata[1:2])
+	if digits == 0:
+		headerlength = 2
+		bytes = len(rawdata)-headerlength
+		if rawdata[-1:] == b'\n':
+			bytes -= 1
+	else:
+		headerlength = 2 + digits
+		bytes = int(rawdata[2:headerlength])
+		#the trailing newline after the data is not part of the block
+		if len(rawdata)-headerlength < bytes:
+			raise ValueError('Binary block is {0} bytes, header declared {1}.'.format(
+				len(rawdata)-headerlength, bytes))
+	bytes_per_pt = np.dtype(data_type).itemsize
 	numberofpoints = bytes/bytes_per_pt
-	#strip out the header
-	#the last data point is excluded because it is a newline character
-	rawdata = rawdata[headerlength:-1]
-	output = np.fromstring(rawdata, dtype = data_type)
+	#frombuffer makes a view of the raw data instead of a copy
+	output = np.frombuffer(rawdata, dtype=data_type, count=numberofpoints, 
+		offset=headerlength)
 	return output
 
-def get_avt(inst):
+def read_binblock(inst, data_type, chunk_size=1048576, progress=None):
+	"""
+	This function reads an IEEE 488.2 binary block straight from the
+	instrument after the query has been written. The header is read
+	first so the output array can be preallocated, then the payload is
+	read in chunk_size pieces directly into it, so only one copy of the
+	trace is ever held in memory.
+	progress is an optional callback called as progress(received, total)
+	after every chunk.
+	Indefinite length '#0' blocks are read to the end of the message.
+	Raises ValueError if the header is malformed or the instrument
+	sends fewer bytes than the header declared.
+	"""
+	def read(count):
+		return inst.visalib.read(inst.session, count)[0]
+
+	header = read(2)
+	if header[0:1] != b'#':
+		raise ValueError('Binary block header not found.')
+	digits = int(header[1:2])
+	if digits == 0:
+		return binblock_parser(header + inst.read_raw(), data_type)
+
+	bytes = int(read(digits))
+	bytes_per_pt = np.dtype(data_type).itemsize
+	if bytes%bytes_per_pt != 0:
+		raise ValueError('Binary block of {0} bytes is not a whole number of points.'.format(bytes))
+	output = np.empty(bytes/bytes_per_pt, dtype=data_type)
+	buf = output.view(np.uint8)
+	received = 0
+	while received < bytes:
+		chunk = read(min(chunk_size, bytes-received))
+		if len(chunk) == 0:
+			raise ValueError('Binary block is {0} bytes, header declared {1}.'.format(
+				received, bytes))
+		buf[received:received+len(chunk)] = np.frombuffer(chunk, dtype=np.uint8)
+		received += len(chunk)
+		if progress is not None:
+			progress(received, bytes)
+	#read the trailing newline so it isn't left in the output buffer
+	read(1)
+	return output
+
+def get_avt(inst, progress=None):
 	#get raw amplitude vs time data from RSA
+	#progress is an optional callback, see read_binblock()
 	inst.write('fetch:avtime:first?')
-	rawdata = inst.read_raw()
-	#print('Raw data length: {0}'.format(len(rawdata)))
+	avt = read_binblock(inst, np.float32, progress=progress)
 
 	acq_time = float(inst.ask('display:avtime:x:scale:full?'))
-	avt = binblock_parser(rawdata, np.float32)
 	Fs = len(avt)/acq_time
 	status_text = err_check(inst)
 
 	return avt, Fs, acq_time, status_text
 
-def hi_lo_calculator(data):
-	#This function uses the histogram method to determine hi/low levels
-	DEFAULT = 40
-	hi = lo = DEFAULT
-	abs_half = (np.amax(data)+np.amin(data))/2
-	hist, bins = np.histogram(data,50)
-	while (hi == DEFAULT) or (lo == DEFAULT):
-		index = np.argmax(hist)
-		amp = bins[index]
-		if amp >= abs_half:
-			if hi == DEFAULT:		
-				hi = amp
-			hist = np.delete(hist,index)
-			bins = np.delete(bins,index)
-		elif amp < abs_half:
-			hist = np.delete(hist,index)
-			bins = np.delete(bins,index)
-			lo = amp	
+def iq_to_avt(I, Q):
+	"""
+	This function converts IQ samples in volts (50 ohm) to an amplitude
+	vs time trace in dBm, the same units SignalVu-PC returns
+	"""
+	with np.errstate(divide='ignore'):
+		return (10*np.log10(((I**2 + Q**2)/100)/.001)).astype(np.float32)
+
+def level_estimator(data, method='histogram', bins=50, pct=10):
+	"""
+	This function estimates the hi and lo levels of the AvT trace in a
+	single vectorized pass and never plots. Methods:
+	'histogram' picks the most populated bin above and below the midpoint
+		of the trace extremes (same result as the original loop)
+	'otsu' splits the histogram into the two clusters with the largest
+		between-class variance (2-means) and returns the cluster means
+	'percentile' returns the pct and 100-pct percentiles of the trace
+	Returns hi, lo, and a confidence dict with 'separability' (between 
+	class variance over total variance, 0 to 1), 'snr' (hi-lo over the
+	pooled cluster standard deviation), and 'split' (the level used to
+	separate the two clusters).
+	"""
+	data = np.asarray(data)
+	if not np.isfinite(data).all():
+		#exact zero IQ samples are -inf dBm
+		data = data[np.isfinite(data)]
+	hist, edges = np.histogram(data, bins)
+	hist = hist.astype(np.float64)
+	left = edges[:-1]
+	centers = (edges[:-1]+edges[1:])/2
+
+	if method == 'histogram':
+		#edges[0] and edges[-1] are the trace min and max
+		split = (edges[0]+edges[-1])/2
+		upper = left >= split
+		if upper.all() or not upper.any():
+			hi = lo = left[np.argmax(hist)]
+		else:
+			hi = left[upper][np.argmax(hist[upper])]
+			lo = left[~upper][np.argmax(hist[~upper])]
+	elif method == 'otsu':
+		w0 = np.cumsum(hist)[:-1]
+		w1 = hist.sum()-w0
+		m0 = np.cumsum(hist*centers)[:-1]
+		with np.errstate(divide='ignore', invalid='ignore'):
+			mu0 = m0/w0
+			mu1 = (np.sum(hist*centers)-m0)/w1
+			between = np.nan_to_num(w0*w1*(mu0-mu1)**2)
+		k = np.argmax(between)
+		split = edges[k+1]
+		hi = mu1[k]
+		lo = mu0[k]
+	elif method == 'percentile':
+		lo, hi = np.percentile(data, [pct, 100-pct])
+		split = (hi+lo)/2
+	else:
+		raise ValueError('Unknown level estimation method: {0}'.format(method))
+
+	#confidence metrics from the histogram split into two clusters
+	upper = centers >= split
+	w0 = hist[~upper].sum()
+	w1 = hist[upper].sum()
+	confidence = {'separability': 0.0, 'snr': 0.0, 'split': split}
+	if (w0 > 0) and (w1 > 0):
+		mu0 = np.sum(hist[~upper]*centers[~upper])/w0
+		mu1 = np.sum(hist[upper]*centers[upper])/w1
+		var0 = np.sum(hist[~upper]*(centers[~upper]-mu0)**2)/w0
+		var1 = np.sum(hist[upper]*(centers[upper]-mu1)**2)/w1
+		total = w0+w1
+		between = (w0/total)*(w1/total)*(mu1-mu0)**2
+		within = (w0*var0+w1*var1)/total
+		if between+within > 0:
+			confidence['separability'] = between/(between+within)
+		if var0+var1 > 0:
+			confidence['snr'] = (mu1-mu0)/np.sqrt((var0+var1)/2)
+	return hi, lo, confidence
+
+def hi_lo_calculator(data, method='histogram'):
+	#This function determines hi/low levels, see level_estimator()
+	hi, lo, confidence = level_estimator(data, method)
 	return hi, lo
 
+def edge_finder(data, d_point, hysteresis=0, min_width=0):
+	"""
+	This function finds every rising and falling crossing of d_point in
+	one vectorized pass and returns them as two index arrays (the index
+	of the first sample on the new side of the threshold).
+	hysteresis is a band in dB centered on d_point: a sample only
+	switches the state high above d_point+hysteresis/2 or low at or
+	below d_point-hysteresis/2, anything in between holds the state.
+	min_width rejects glitches: high or low runs shorter than min_width
+	samples are merged into the run before them.
+	"""
+	data = np.asarray(data)
+	if len(data) == 0:
+		return np.zeros(0, dtype=np.int64), np.zeros(0, dtype=np.int64)
+	if hysteresis > 0:
+		high = data > d_point+hysteresis/2.0
+		low = data <= d_point-hysteresis/2.0
+		#forward fill the last decided state through the band
+		decided = np.where(high | low, np.arange(len(data)), 0)
+		np.maximum.accumulate(decided, out=decided)
+		state = high[decided]
+		if not (high[0] or low[0]):
+			#samples before the first decision take the plain comparison
+			undecided = decided == 0
+			state[undecided] = data[undecided] > d_point
+	else:
+		state = data > d_point
+
+	edges = np.flatnonzero(state[1:] != state[:-1]) + 1
+	new_state = state[edges]
+	if (min_width > 1) and (len(edges) > 0):
+		#run length encode the state and absorb short runs
+		starts = np.concatenate(([0], edges))
+		lengths = np.diff(np.concatenate((starts, [len(data)])))
+		values = state[starts]
+		keep = lengths >= min_width
+		keep[0] = True
+		owner = np.where(keep, np.arange(len(starts)), 0)
+		np.maximum.accumulate(owner, out=owner)
+		values = values[owner]
+		change = np.flatnonzero(values[1:] != values[:-1]) + 1
+		edges = starts[change]
+		new_state = values[change]
+
+	rising = edges[new_state]
+	falling = edges[~new_state]
+	return rising, falling
+
 def firstedge_finder(data, hi, lo, thresh):
 	"""
 	This function finds the first rising edge of the AvT trace and
@@ -168,79 +644,545 @@ def firstedge_finder(data, hi, lo, thresh):
 	"""
 	#d_point = (hi+lo)*.5
 	d_point = hi-thresh
-	saved = data[0]
-
-	for index in range(len(data)):
-		if data[index] <= d_point:
-			saved = data[index]
-		else:
-			if saved <= d_point:
-				break
+	rising, falling = edge_finder(data, d_point)
+	if len(rising) > 0:
+		index = rising[0]
+	else:
+		index = len(data)-1
 
 	#print('Hi: {0} Lo: {1} d_point: {2}'.format(hi,lo,d_point))
 	return index, d_point
 
-def ask_decode(data, sym_rate, samp_rate, thresh):
+def symbol_slicer(data, d_point, start_index, dec_offset, sa_per_sym, valid_sym):
+	"""
+	This function computes every decision index at once and slices the
+	AvT trace against d_point in a single array operation. Indices are
+	truncated to integers the same way the old per-symbol loop did, and
+	any that run off the end of the trace are dropped. Returns the
+	symbol table as a uint8 array.
+	"""
+	index = np.arange(valid_sym)*sa_per_sym+dec_offset+start_index
+	index = index.astype(np.int64)
+	index = index[index < len(data)]
+	return (data[index] >= d_point).astype(np.uint8)
+
+def integrate_slicer(data, d_point, start_index, sa_per_sym, valid_sym, window=0.8):
+	"""
+	This function makes integrate-and-dump symbol decisions. Each symbol
+	is decided from the mean of the AvT trace over the central window
+	fraction of its symbol period (the symbol edges are skipped) instead
+	of a single sample, so noise is averaged down and far fewer samples
+	per symbol are needed. All the sums come from one cumulative sum.
+	Symbols whose window runs off the end of the trace are dropped.
+	Returns the symbol table as a uint8 array.
+	"""
+	symbols = np.arange(valid_sym)*sa_per_sym+start_index
+	means = symbol_means(data, symbols, sa_per_sym, window)
+	return (means >= d_point).astype(np.uint8)
+
+def symbol_means(data, symbols, sa_per_sym, window=0.8):
+	"""
+	This function returns the mean of the AvT trace over the central
+	window fraction of each symbol, symbols being the (fractional) start
+	index of every symbol. Symbols that run off the end are dropped.
+	"""
+	guard = sa_per_sym*(1-window)/2
+	starts = (symbols+guard).astype(np.int64)
+	stops = np.maximum((symbols+sa_per_sym-guard).astype(np.int64), starts+1)
+	keep = stops <= len(data)
+	starts, stops = starts[keep], stops[keep]
+	total = np.zeros(len(data)+1)
+	np.cumsum(data, dtype=np.float64, out=total[1:])
+	return (total[stops]-total[starts])/(stops-starts)
+
+def edge_times(data, d_point, hysteresis=0, min_width=0):
+	"""
+	This function returns the time of every threshold crossing in
+	fractional samples, interpolated linearly between the two samples
+	on either side of d_point (see edge_finder for the other arguments)
+	"""
+	rising, falling = edge_finder(data, d_point, hysteresis, min_width)
+	edges = np.sort(np.concatenate((rising, falling)))
+	edges = edges[edges > 0]
+	before = data[edges-1].astype(np.float64)
+	step = data[edges]-before
+	step[step == 0] = 1
+	frac = np.clip((d_point-before)/step, 0, 1)
+	return edges-1+frac
+
+def symbol_timing(data, d_point, start_index, sa_per_sym, block_symbols=16,
+	phase_gain=0.5, rate_gain=0.5, hysteresis=0):
+	"""
+	This function tracks symbol phase and rate across the record with
+	an early-late loop driven by the threshold crossings. The record is
+	handled block_symbols symbols at a time: every crossing in a block
+	is matched to its nearest expected symbol boundary, and a line fit
+	of the timing errors against symbol number gives the phase error
+	(early/late) and the symbol period error of the block, which are
+	fed back through phase_gain and rate_gain. Each block is vectorized,
+	so the loop runs once per block rather than once per sample.
+	sa_per_sym is the nominal samples per symbol to start from.
+	Returns the (fractional) start index of every symbol from
+	start_index to the end of the record and the average samples per
+	symbol actually tracked.
+	"""
+	data = np.asarray(data)
+	times = edge_times(data, d_point, hysteresis)
+	times = times[times >= start_index-1]
+	anchor_n = 0
+	anchor_t = float(start_index)
+	if len(times) > 0 and times[0] < start_index:
+		#start on the interpolated first edge
+		anchor_t = times[0]
+	period = float(sa_per_sym)
+	blocks = []
+	n0 = 0
+	while anchor_t+(n0-anchor_n)*period < len(data):
+		n1 = n0+block_symbols
+		low = anchor_t+(n0-anchor_n-0.5)*period
+		high = anchor_t+(n1-anchor_n-0.5)*period
+		t = times[np.searchsorted(times, low):np.searchsorted(times, high)]
+		if len(t) > 0:
+			n = np.round((t-anchor_t)/period+anchor_n)
+			error = t-(anchor_t+(n-anchor_n)*period)
+			n_mean = n.mean()
+			phase_error = error.mean()
+			spread = n-n_mean
+			rate_error = 0
+			if np.ptp(n) >= block_symbols//2:
+				#only crossings spread over the block give a usable slope
+				rate_error = (spread*(error-phase_error)).sum()/(spread**2).sum()
+			anchor_t += (n_mean-anchor_n)*period+phase_gain*phase_error
+			anchor_n = n_mean
+			period += rate_gain*rate_error
+		blocks.append(anchor_t+(np.arange(n0, n1)-anchor_n)*period)
+		n0 = n1
+	if not blocks:
+		return np.zeros(0), period
+	symbols = np.concatenate(blocks)
+	symbols = symbols[symbols+period/2 < len(data)]
+	if len(symbols) > 1:
+		period = (symbols[-1]-symbols[0])/(len(symbols)-1)
+	return symbols, period
+
+def tracked_slicer(data, d_point, symbols, sa_per_sym, decision='sample',
+	window=0.8):
+	"""
+	This function slices the AvT trace at the symbol start positions
+	from symbol_timing(), at the center of each symbol or integrated
+	over it (see integrate_slicer). Returns the symbol table as uint8.
+	"""
+	if decision == 'integrate':
+		means = symbol_means(data, symbols, sa_per_sym, window)
+		return (means >= d_point).astype(np.uint8)
+	index = (symbols+sa_per_sym/2).astype(np.int64)
+	index = index[index < len(data)]
+	return (data[index] >= d_point).astype(np.uint8)
+
+def period_fit(intervals, period, passes=3):
+	"""
+	This function refines a symbol period guess against the intervals
+	between crossings, which are whole numbers of symbols. Each pass
+	rounds every interval to whole symbols and divides the total time
+	by the total symbols, so the timing errors of the crossings between
+	neighbouring intervals cancel. Returns the period and the fraction
+	of intervals that land within 0.2 symbols of a whole number of
+	symbols.
+	"""
+	for i in range(passes):
+		k = np.maximum(np.round(intervals/period), 1)
+		period = intervals.sum()/k.sum()
+	k = np.maximum(np.round(intervals/period), 1)
+	fit = np.mean(np.abs(intervals/period-k) < 0.2)
+	return period, fit
+
+def sym_rate_estimator(data, samp_rate, thresh=3, method='edges', d_point=None,
+	min_width=3):
+	"""
+	This function estimates the symbol rate of the AvT trace from its
+	threshold crossings in one vectorized pass. d_point defaults to
+	thresh dB below the hi level like ask_decode. The crossings are
+	found with thresh dB of hysteresis and runs shorter than min_width
+	samples are ignored so noise spikes on the idle carrier don't count.
+	'edges' takes the mean of the shortest cluster of high run lengths
+	and the shortest cluster of low run lengths as the first guess of
+	the symbol period.
+	'fft' takes the lowest strong spectral line of the crossing impulse
+	train (the derivative of the sliced envelope) as the first guess,
+	which holds up better when single symbol runs are rare.
+	Either guess is refined with period_fit() against every high plus
+	low run pair. Crossings are interpolated at d_point, which is near
+	the top of a sharp edge, so high runs come out short and low runs
+	long by the same amount. Pairs and the mean of the two guesses
+	cancel that.
+	Returns the symbol rate in sym/sec (None if there are too few
+	crossings) and a 0 to 1 confidence: the fraction of run pairs that
+	fit the estimated symbol grid, scaled by the spectral line strength
+	for 'fft'.
+	"""
+	data = np.asarray(data)
+	if d_point is None:
+		hi, lo = hi_lo_calculator(data)
+		d_point = hi-thresh
+	times = edge_times(data, d_point, thresh, min_width)
+	#crossings alternate, so runs alternate between high and low
+	intervals = np.diff(times)
+	runs = (intervals[0::2], intervals[1::2])
+	#anything shorter than 1.5 samples is a noise glitch, not a symbol
+	runs = [run[run >= 1.5] for run in runs]
+	if min(len(run) for run in runs) == 0:
+		return None, 0.0
+	pairs = intervals[:-1]+intervals[1:]
+
+	if method == 'edges':
+		guesses = []
+		for run in runs:
+			shortest = np.percentile(run, 10)
+			guesses.append(np.mean(run[run <= 1.5*shortest]))
+		period = np.mean(guesses)
+		strength = 1.0
+	elif method == 'fft':
+		#power of 2 length keeps the FFT fast for any record length
+		length = 2**int(np.ceil(np.log2(len(data))))
+		impulses = np.zeros(length, dtype=np.float32)
+		impulses[times.astype(np.int64)] = 1
+		spectrum = np.abs(np.fft.rfft(impulses))
+		#ignore DC and anything faster than a symbol every 2 samples
+		top = length//2
+		spectrum[:2] = 0
+		spectrum[top:] = 0
+		peak = np.amax(spectrum)
+		lines = np.flatnonzero(spectrum >= 0.5*peak)
+		line = lines[0]
+		#strongest bin next to the lowest strong line
+		line = line+np.argmax(spectrum[line:line+3])
+		period = length/float(line)
+		strength = 1-np.median(spectrum[2:top])/peak
+	else:
+		raise ValueError('Unknown symbol rate estimation method: {0}'.format(method))
+
+	#single runs tolerate a rough guess best, the pairs remove their bias
+	period, fit = period_fit(intervals, period)
+	period, fit = period_fit(pairs, period)
+	return samp_rate/period, fit*strength
+
+def pack_symbols(sym_table):
+	"""This function bit-packs a symbol table, 8 symbols per byte"""
+	return np.packbits(np.asarray(sym_table, dtype=np.uint8))
+
+def ask_decode(data, sym_rate, samp_rate, thresh, decision='sample',
+	track=False, check=None):
 	"""
 	This function demods the AvT trace based on symbol rate, sample rate,
 	and decision threshold as a percentage of amplitude. It begins demod
 	at the first rising edge of the AvT trace. It returns the symbol table 
 	and info needed to annotate the resulting plot.
+	decision is 'sample' to slice one sample at the center of each symbol
+	or 'integrate' for integrate-and-dump decisions (see integrate_slicer)
+	track follows symbol clock drift with symbol_timing(), sym_rate is
+	then only the starting guess and the tracked average samples per
+	symbol is returned in the annotations (samp_rate/annot[4] is the
+	estimated symbol rate), followed by the sample index of every
+	decision as annot[5] since they are no longer evenly spaced
+	sym_rate None estimates the symbol rate with sym_rate_estimator()
+	check is an optional callback called between the stages (levels,
+	rate estimate, timing, slicing), it may raise to abandon the demod
 	"""
-	sa_per_sym = samp_rate/sym_rate
 	hi, lo = hi_lo_calculator(data)
 	start_index, d_point = firstedge_finder(data, hi, lo, thresh)
+	if check is not None:
+		check()
+	if sym_rate is None:
+		sym_rate, confidence = sym_rate_estimator(data, samp_rate, thresh,
+			d_point=d_point)
+		if sym_rate is None:
+			raise ValueError('Too few edges to estimate the symbol rate.')
+		if check is not None:
+			check()
+	sa_per_sym = samp_rate/sym_rate
+	if decision not in ('sample', 'integrate'):
+		raise ValueError('Unknown decision mode: {0}'.format(decision))
+	if track:
+		symbols, sa_per_sym = symbol_timing(data, d_point, start_index,
+			sa_per_sym)
+		if check is not None:
+			check()
+		sym_table = tracked_slicer(data, d_point, symbols, sa_per_sym, decision)
+		#both slicers only drop symbols off the end of the record
+		dec_index = (symbols+sa_per_sym/2).astype(np.int64)[:len(sym_table)]
+		annot = [d_point, start_index, int(sa_per_sym/2), len(sym_table),
+			sa_per_sym, dec_index]
+		return sym_table, annot
 	dec_offset = int((sa_per_sym/2))
 	num_sym = int(len(data)/sa_per_sym)
 	valid_sym = num_sym - int((start_index+dec_offset)/sa_per_sym)
-	sym_table = np.zeros(valid_sym)
-
-	for i in range(valid_sym):
-		if i == 0:
-			index = start_index+dec_offset
-		index = i*sa_per_sym+dec_offset+start_index
-		decision = data[index]
-		if decision >= d_point:
-			sym_table[i] = 1
-		else:
-			sym_table[i] = 0
+	if decision == 'integrate':
+		sym_table = integrate_slicer(data, d_point, start_index, sa_per_sym, valid_sym)
+	else:
+		sym_table = symbol_slicer(data, d_point, start_index, dec_offset, 
+			sa_per_sym, valid_sym)
+	valid_sym = len(sym_table)
 
 	annot = [d_point, start_index, dec_offset, valid_sym, sa_per_sym]
 	return sym_table, annot
 
-def manchester_ask_decode(symbol_table_o):
-	#print('original symbol table length: {}'.format(len(symbol_table_o)))
-	symbol_table = symbol_table_o
-	if symbol_table[0] == symbol_table[1]:
-		symbol_table = symbol_table[1:]
-		#print('symbol table length changed to: {}'.format(len(symbol_table)))
-	if len(symbol_table)%2 != 0:
-		symbol_table = symbol_table[:-1]
-		#print('symbol table length changed to: {}'.format(len(symbol_table)))
-	#print('Symbol table length: {}'.format(len(symbol_table)))
-	valid_sym = len(symbol_table)/2-1
-
-	manch_table = np.zeros(valid_sym)
-
-	reset_flag = 1
-	while reset_flag == 1:
-		reset_flag = 0
-		for i in range(valid_sym):
-			j = 2*i
-			if (symbol_table[j] == 0) and (symbol_table[j+1] == 1):
-				manch_table[i] = 1
-				#print(symbol_table[j], symbol_table[j+1], manch_table[i])
-			elif (symbol_table[j] == 1) and (symbol_table[j+1] == 0):
-				manch_table[i] = 0
-				#print(symbol_table[j], symbol_table[j+1], manch_table[i])
-			else:
-				reset_flag = 1
-				symbol_table = symbol_table_o[1:-1]
-				valid_sym = len(symbol_table)/2-1
-				symbol_table_o = symbol_table
+def burst_finder(data, gate, holdoff, min_length=1):
+	"""
+	This function segments a record into bursts by energy gating. A burst
+	starts at the first sample above gate and ends at the last one before
+	the trace stays at or below gate for more than holdoff samples, so
+	off symbols inside a burst don't split it. Bursts shorter than
+	min_length samples are dropped as noise. Returns an (N, 2) array of
+	burst start and stop indices (stop is one past the last sample).
+	"""
+	above = np.flatnonzero(np.asarray(data) > gate)
+	if len(above) == 0:
+		return np.zeros((0, 2), dtype=np.int64)
+	breaks = np.flatnonzero(np.diff(above) > holdoff)
+	starts = np.concatenate(([above[0]], above[breaks+1]))
+	stops = np.concatenate((above[breaks]+1, [above[-1]+1]))
+	keep = stops-starts >= min_length
+	return np.column_stack((starts[keep], stops[keep]))
+
+def burst_job(job):
+	#ask_decode one burst, module level so the process pool can pickle it
+	return ask_decode(*job)
+
+def demod_bursts(data, sym_rate, samp_rate, thresh, holdoff=16, gate=None,
+	decision='sample', track=False, processes=None):
+	"""
+	This function finds every burst in the AvT trace with burst_finder
+	and demods each one independently with ask_decode, so packets
+	separated by idle gaps each get their own levels and first edge.
+	holdoff is the longest gap inside a burst in symbols. gate is the
+	energy gate in dBm, by default the Otsu split between the idle and
+	burst levels of the whole record (the histogram hi level is the idle
+	level when the record is mostly idle). Records of at
+	least PARALLEL_SAMPLES samples are demodulated on a process pool
+	(processes=1 forces serial). Returns a list with the start time in
+	seconds, symbol table, and annotations of each burst. The start
+	index (and tracked decision indices) in the annotations are relative
+	to the whole record.
+	"""
+	data = np.asarray(data)
+	if gate is None:
+		hi, lo, confidence = level_estimator(data, 'otsu')
+		gate = confidence['split']
+	if sym_rate is None:
+		sym_rate, confidence = sym_rate_estimator(data, samp_rate, thresh,
+			d_point=gate)
+		if sym_rate is None:
+			raise ValueError('Too few edges to estimate the symbol rate.')
+	sa_per_sym = samp_rate/sym_rate
+	bursts = burst_finder(data, gate, int(holdoff*sa_per_sym),
+		max(int(sa_per_sym/2), 1))
+
+	#a symbol of lead-in to find the first edge, half of one to finish
+	#the last symbol
+	jobs = []
+	offsets = []
+	for start, stop in bursts:
+		first = max(start-int(sa_per_sym), 0)
+		last = min(stop+int(sa_per_sym/2)+1, len(data))
+		jobs.append((data[first:last], sym_rate, samp_rate, thresh, decision,
+			track))
+		offsets.append(first)
+
+	if (processes == 1) or (len(jobs) < 2) or (len(data) < PARALLEL_SAMPLES):
+		results = map(burst_job, jobs)
+	else:
+		pool = multiprocessing.Pool(processes)
+		try:
+			results = pool.map(burst_job, jobs, chunksize=1)
+		finally:
+			pool.close()
+			pool.join()
+
+	output = []
+	for offset, (sym_table, annot) in zip(offsets, results):
+		annot[1] += offset
+		if len(annot) > 5:
+			annot[5] = annot[5]+offset
+		output.append((annot[1]/float(samp_rate), sym_table, annot))
+	return output
+
+def manchester_decode(symbol_table, differential=False, window=8):
+	"""
+	This function decodes a Manchester (or differential Manchester)
+	symbol table in time linear in the number of symbols. 
+	Both pair alignments are scored at once and the better one is used.
+	An invalid pair (two equal half-bits) does not restart the decode:
+	its position is recorded and the alignment is re-chosen locally by
+	comparing the number of valid pairs in the next window pairs for
+	the current alignment and for the one shifted by one symbol.
+	Manchester: 01 = 1, 10 = 0
+	Differential Manchester: no transition at the start of the bit = 1,
+	transition = 0 (the first bit has no reference and is dropped)
+	Returns the decoded table as uint8 and the symbol indices of the
+	invalid pairs.
+	"""
+	sym = np.asarray(symbol_table, dtype=np.uint8)
+	n = len(sym)
+	if n < 2:
+		return np.zeros(0, dtype=np.uint8), np.zeros(0, dtype=np.int64)
+	#valid[j] is True if the pair starting at symbol j is a valid bit
+	valid = sym[:-1] != sym[1:]
+	#valid pair counts along each alignment, for the local window scores
+	counts = [np.concatenate(([0], np.cumsum(valid[p::2]))) for p in (0,1)]
+	invalid = [np.flatnonzero(~valid[p::2])*2+p for p in (0,1)]
+
+	def score(start, pairs):
+		p = start%2
+		first = start//2
+		last = min(first+pairs, len(counts[p])-1)
+		return counts[p][last]-counts[p][first]
+
+	pos = 0
+	if score(1, len(valid)) > score(0, len(valid)):
+		pos = 1
+	starts = []
+	errors = []
+	while pos < len(valid):
+		p = pos%2
+		k = np.searchsorted(invalid[p], pos)
+		if k < len(invalid[p]):
+			bad = invalid[p][k]
+		else:
+			bad = len(valid)+(len(valid)-pos)%2
+		starts.append(np.arange(pos, min(bad, len(valid)), 2))
+		if bad >= len(valid):
+			break
+		errors.append(bad)
+		#stay on this alignment past the bad pair or slip by one symbol
+		if score(bad+2, window) >= score(bad+1, window):
+			pos = bad+2
+		else:
+			pos = bad+1
+
+	starts = np.concatenate(starts) if starts else np.zeros(0, dtype=np.int64)
+	if differential:
+		starts = starts[starts > 0]
+		manch_table = (sym[starts] == sym[starts-1]).astype(np.uint8)
+	else:
+		manch_table = sym[starts+1]
+	return manch_table, np.array(errors, dtype=np.int64)
+
+def manchester_ask_decode(symbol_table, differential=False):
+	"""This function returns the Manchester decoded symbol table"""
+	manch_table, errors = manchester_decode(symbol_table, differential)
 	return manch_table
 
 
+def sync_errors(sym_table, sync_word):
+	"""
+	This function returns the number of bit errors between sync_word and
+	the symbol table at every offset where the whole word fits. Short
+	words are compared one word bit at a time across the whole table,
+	long ones by FFT cross-correlation of the +/-1 sequences, so the
+	cost never involves a Python loop over the table.
+	"""
+	sym = np.asarray(sym_table, dtype=np.uint8)
+	word = np.asarray(sync_word, dtype=np.uint8)
+	length = len(word)
+	offsets = len(sym)-length+1
+	if (length == 0) or (offsets <= 0):
+		return np.zeros(0, dtype=np.int64)
+	if length <= 64:
+		errors = np.zeros(offsets, dtype=np.int64)
+		for j in range(length):
+			errors += sym[j:j+offsets] != word[j]
+		return errors
+	size = 2**int(np.ceil(np.log2(len(sym)+length)))
+	a = np.fft.rfft(2.0*sym-1, size)
+	b = np.fft.rfft((2.0*word-1)[::-1], size)
+	corr = np.fft.irfft(a*b, size)[length-1:length-1+offsets]
+	return np.round((length-corr)/2).astype(np.int64)
+
+def sync_pattern(sync_word):
+	#'0'/'1' strings or any sequence of 0s and 1s
+	if isinstance(sync_word, basestring):
+		return np.array([int(bit) for bit in sync_word.strip()], dtype=np.uint8)
+	return np.asarray(sync_word, dtype=np.uint8)
+
+def frame_sync(sym_table, sync_words, max_errors=0, frame_length=None):
+	"""
+	This function locates frames in a symbol table by their sync words.
+	sync_words is one sync word or a list of them, each a '0'/'1' string
+	or a sequence of bits, and a match may have up to max_errors bit
+	errors. Where matches overlap, the one with the fewest bit errors
+	(then the earliest) wins. The payload runs from the end
+	of the sync word to the next frame (or the end of the table), cut
+	to frame_length symbols if given.
+	Returns a list of (frame start index, sync word index, bit errors,
+	payload) tuples.
+	"""
+	sym = np.asarray(sym_table, dtype=np.uint8)
+	if isinstance(sync_words, basestring) or (len(sync_words) > 0 and
+		np.isscalar(sync_words[0]) and not isinstance(sync_words[0], basestring)):
+		#a single word, not a list of words
+		sync_words = [sync_words]
+	words = [sync_pattern(word) for word in sync_words]
+	if not words:
+		return []
+
+	#every match of every word, by bit errors then position
+	starts = []
+	word_index = []
+	bit_errors = []
+	for i, word in enumerate(words):
+		errors = sync_errors(sym, word)
+		hits = np.flatnonzero(errors <= max_errors)
+		starts.append(hits)
+		word_index.append(np.full(len(hits), i, dtype=np.int64))
+		bit_errors.append(errors[hits])
+	starts = np.concatenate(starts)
+	bit_errors = np.concatenate(bit_errors)
+	order = np.lexsort((starts, bit_errors))
+	starts = starts[order]
+	word_index = np.concatenate(word_index)[order]
+	bit_errors = bit_errors[order]
+	stops = starts+np.array([len(word) for word in words])[word_index]
+
+	#overlaps are resolved one bit error count at a time, fewest first:
+	#matches overlapping an accepted match with fewer errors are dropped
+	#in one vectorized pass against the accepted words (which never
+	#overlap, so they are sorted by both start and stop), then a greedy
+	#scan in position order keeps the earliest of overlapping matches
+	#with the same count
+	taken = np.zeros(0, dtype=np.int64)
+	bounds = np.concatenate(([0], np.flatnonzero(np.diff(bit_errors))+1,
+		[len(bit_errors)]))
+	for first, last in zip(bounds[:-1], bounds[1:]):
+		rows = np.arange(first, last)
+		k = np.searchsorted(starts[taken], starts[rows], 'right')
+		free = np.ones(len(rows), dtype=bool)
+		before = k > 0
+		free[before] = stops[taken[k[before]-1]] <= starts[rows[before]]
+		after = k < len(taken)
+		free[after] &= stops[rows[after]] <= starts[taken[k[after]]]
+		rows = rows[free]
+		keep = []
+		end = 0
+		for row, start, stop in zip(rows.tolist(), starts[rows].tolist(),
+			stops[rows].tolist()):
+			if start >= end:
+				keep.append(row)
+				end = stop
+		taken = np.concatenate((taken, np.array(keep, dtype=np.int64)))
+		taken = taken[np.argsort(starts[taken], kind='mergesort')]
+	frames = zip(starts[taken].tolist(), word_index[taken].tolist(),
+		bit_errors[taken].tolist())
+	output = []
+	for k, (start, i, errors) in enumerate(frames):
+		payload_start = start+len(words[i])
+		payload_stop = len(sym)
+		if k+1 < len(frames):
+			payload_stop = frames[k+1][0]
+		if frame_length is not None:
+			payload_stop = min(payload_stop, payload_start+frame_length)
+		output.append((start, i, errors, sym[payload_start:payload_stop]))
+	return output
+
 def err_check(instrument):
 	"""This function simply queries the instrument for and returns errors"""
 	err_string = instrument.ask('system:error:all?').split(',')
@@ -251,19 +1193,53 @@ def err_check(instrument):
 
 	return status_text
 
+def minmax_decimate(x, y, num_bins):
+	"""
+	This function splits y into num_bins bins and keeps only the
+	minimum and maximum sample of each (in time order), so the envelope
+	of the trace looks the same when drawn at num_bins pixels wide
+	"""
+	if len(y) <= 2*num_bins:
+		return x, y
+	per_bin = len(y)//num_bins
+	trimmed = per_bin*num_bins
+	binned = y[:trimmed].reshape(num_bins, per_bin)
+	offset = np.arange(num_bins)*per_bin
+	index = np.column_stack((np.argmin(binned, axis=1)+offset, 
+		np.argmax(binned, axis=1)+offset))
+	index = np.sort(index, axis=1).ravel()
+	if trimmed < len(y):
+		tail = np.arange(trimmed, len(y))
+		index = np.concatenate((index, 
+			[tail[np.argmin(y[tail])], tail[np.argmax(y[tail])]]))
+		index = np.sort(index)
+	return x[index], y[index]
+
 def ask_plot(axis):
-	"""This function plots a graph of the AvT with demod annotations"""
-	plt.plot(axis.x, axis.y)
-	plt.axhline(y=axis.annot[0])
-	plt.axvline(x=axis.x[axis.annot[1]])
-	for i in range(axis.annot[3]):
-		plt.axvline(x=
-			axis.x[axis.annot[1]+axis.annot[2]+axis.annot[4]*i])
+	"""
+	This function plots a graph of the AvT with demod annotations
+	The trace is min/max decimated to the window width and the decision
+	points are drawn as a single collection of vertical lines, at the
+	tracked decision indices if ask_decode(track=True) returned them
+	"""
+	fig = plt.figure()
+	ax = fig.add_subplot(111)
+	trace = DecimatedTrace(ax, axis.x, axis.y)
+	ax.axhline(y=axis.annot[0])
+	d_point, start_index, dec_offset, valid_sym, sa_per_sym = axis.annot[:5]
+	if len(axis.annot) > 5:
+		index = np.asarray(axis.annot[5], dtype=np.int64)
+	else:
+		index = np.arange(valid_sym)*sa_per_sym+dec_offset+start_index
+		index = index.astype(np.int64)
+	index = np.concatenate(([start_index], index[index < len(axis.x)]))
+	ax.vlines(axis.x[index], 0, 1, transform=ax.get_xaxis_transform())
 	plt.suptitle('Amplitude vs Time')
 	plt.ylabel('Amplitude (dBm)')
 	plt.xlabel('Time (s)')
-	plt.xlim(0,axis.time)
+	ax.set_xlim(0,axis.time)
 	plt.show()
+	return trace
 
 ########################################################################
 ########################################################################
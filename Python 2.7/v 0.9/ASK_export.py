@@ -0,0 +1,166 @@
+"""
+ASK_export.py
+Symbol table export and reload for ASK_demod_guts.py
+The format is picked from the file extension:
+.txt  '0'/'1' text, 64 symbols per line, never truncated
+.hex  hex text of the bit-packed table, 64 hex digits per line
+.bin  raw bit-packed table (np.packbits, MSB first, zero padded)
+.npz  self-describing container: bit-packed symbols, symbol count,
+	  decision level, hi/lo levels, start index, samples per symbol,
+	  tracked decision indices (ask_decode(track=True) only),
+	  sample and symbol rates, and timestamps. Manchester tables
+	  store the decoded bit rate and period, the chip level timing
+	  under chip_* names, and the number of invalid chip pairs
+Tables are written in chunks so multi-million symbol tables export
+without building the whole text in memory, and .npz/.bin/.hex files
+reload with load_symbols() without any text parsing.
+"""
+
+import binascii
+import os
+import time
+import numpy as np
+
+#symbols converted per write, a multiple of 8*64 so lines and bytes align
+CHUNK_SYMBOLS = 8*64*16384
+LINE_SYMBOLS = 64
+
+########################################################################
+#############################FUNCTIONS##################################
+########################################################################
+def symbol_chunks(sym_table, chunk=CHUNK_SYMBOLS):
+	#uint8 views of the symbol table, chunk symbols at a time
+	sym_table = np.asarray(sym_table)
+	for start in xrange(0, len(sym_table), chunk):
+		yield sym_table[start:start+chunk].astype(np.uint8)
+
+def text_lines(characters, line_length):
+	"""This function breaks a uint8 character array into newline ended lines"""
+	full = len(characters)//line_length*line_length
+	lines = np.empty((full//line_length, line_length+1), dtype=np.uint8)
+	lines[:,:line_length] = characters[:full].reshape(-1, line_length)
+	lines[:,line_length] = ord('\n')
+	text = lines.tostring()
+	if full < len(characters):
+		text += characters[full:].tostring() + b'\n'
+	return text
+
+def export_text(output, sym_table):
+	"""This function writes the symbols as '0'/'1' text, 64 per line"""
+	for chunk in symbol_chunks(sym_table):
+		output.write(text_lines(chunk+ord('0'), LINE_SYMBOLS))
+
+def export_packed(output, sym_table):
+	"""This function writes the bit-packed symbols, 8 per byte"""
+	for chunk in symbol_chunks(sym_table):
+		output.write(np.packbits(chunk).tostring())
+
+def export_hex(output, sym_table):
+	"""This function writes the bit-packed symbols as hex text"""
+	for chunk in symbol_chunks(sym_table):
+		digits = binascii.hexlify(np.packbits(chunk).tostring())
+		output.write(text_lines(np.frombuffer(digits, dtype=np.uint8),
+			LINE_SYMBOLS))
+
+def symbol_metadata(annot=None, samp_rate=None, sym_rate=None, hi=None,
+	lo=None, manchester=False, invalid_pairs=None):
+	"""
+	This function collects the demod settings stored with an .npz export
+	annot is the annotation list returned by ask_decode and sym_rate the
+	rate it was decoded at. With manchester=True those describe chips,
+	so they are stored as chip_rate, chip_period, sa_per_chip,
+	chip_dec_offset, first_chip_time, and chip_dec_index, and sym_rate,
+	sa_per_sym, and symbol_period are the decoded bit (2 chip) values.
+	invalid_pairs is the number of chip pairs manchester_decode skipped.
+	"""
+	meta = {'created': time.time(), 'manchester': manchester}
+	#the decode timing is per chip for Manchester, 2 chips per bit
+	chip = ''
+	chips = 1
+	first_name = 'first_symbol_time'
+	if manchester:
+		chip = 'chip_'
+		chips = 2
+		first_name = 'first_chip_time'
+	if annot is not None:
+		d_point, start_index, dec_offset, valid_sym, sa_per_sym = annot[:5]
+		meta.update({'d_point': d_point, 'start_index': start_index,
+			chip+'dec_offset': dec_offset, 'sa_per_sym': sa_per_sym*chips})
+		first_index = start_index+dec_offset
+		if len(annot) > 5:
+			#tracked decision indices
+			meta[chip+'dec_index'] = annot[5]
+			if len(annot[5]) > 0:
+				first_index = annot[5][0]
+		if samp_rate:
+			#time of the first decision point and the symbol spacing
+			meta[first_name] = first_index/float(samp_rate)
+			meta['symbol_period'] = sa_per_sym*chips/float(samp_rate)
+		if manchester:
+			meta['sa_per_chip'] = sa_per_sym
+			if samp_rate:
+				meta['chip_period'] = sa_per_sym/float(samp_rate)
+	if manchester and (sym_rate is not None):
+		meta['chip_rate'] = sym_rate
+		sym_rate = sym_rate/2.0
+	for name, value in (('samp_rate', samp_rate), ('sym_rate', sym_rate),
+		('hi', hi), ('lo', lo), ('invalid_pairs', invalid_pairs)):
+		if value is not None:
+			meta[name] = value
+	return meta
+
+def export_npz(output, sym_table, meta=None):
+	"""This function writes a bit-packed symbol table and its metadata"""
+	sym_table = np.asarray(sym_table, dtype=np.uint8)
+	arrays = dict((name, np.asarray(value)) for name, value in (meta or {}).items())
+	arrays['symbols'] = np.packbits(sym_table)
+	arrays['num_symbols'] = np.asarray(len(sym_table))
+	np.savez(output, **arrays)
+
+def export_symbols(filename, sym_table, meta=None):
+	"""
+	This function exports a symbol table in the format given by the
+	extension of filename (.txt, .hex, .bin, or .npz, see above)
+	meta is a dict from symbol_metadata(), only .npz stores it
+	"""
+	extension = os.path.splitext(filename)[1].lower()
+	if extension == '.npz':
+		with open(filename, 'wb') as output:
+			export_npz(output, sym_table, meta)
+	elif extension == '.bin':
+		with open(filename, 'wb') as output:
+			export_packed(output, sym_table)
+	elif extension == '.hex':
+		with open(filename, 'wb') as output:
+			export_hex(output, sym_table)
+	elif extension == '.txt':
+		with open(filename, 'wb') as output:
+			export_text(output, sym_table)
+	else:
+		raise ValueError('Unknown symbol table format: {0}'.format(extension))
+
+def load_symbols(filename):
+	"""
+	This function reloads a .npz, .bin, or .hex export and returns the
+	symbol table as uint8 and the metadata dict (empty except for .npz)
+	.bin and .hex do not store the symbol count, so up to 7 padding
+	zeros may follow the last symbol
+	"""
+	extension = os.path.splitext(filename)[1].lower()
+	meta = {}
+	if extension == '.npz':
+		saved = np.load(filename)
+		sym_table = np.unpackbits(saved['symbols'])[:int(saved['num_symbols'])]
+		for name in saved.files:
+			if name not in ('symbols', 'num_symbols'):
+				meta[name] = saved[name][()]
+	elif extension == '.bin':
+		sym_table = np.unpackbits(np.fromfile(filename, dtype=np.uint8))
+	elif extension == '.hex':
+		with open(filename, 'rb') as saved:
+			digits = b''.join(saved.read().split())
+		sym_table = np.unpackbits(np.frombuffer(binascii.unhexlify(digits),
+			dtype=np.uint8))
+	else:
+		raise ValueError('Cannot reload symbol table format: {0}'.format(extension))
+	return sym_table, meta
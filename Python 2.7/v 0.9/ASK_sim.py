@@ -0,0 +1,172 @@
+"""
+ASK_sim.py
+Simulated instrument backend for ASK_demod_guts.py
+Answers the same SCPI commands and queries the demodulator sends to
+an RSA over VISA and serves synthesized 2ASK/OOK/Manchester bursts, so
+the full acquire -> demod pipeline can be run and timed without an
+instrument. Connect with Tek_Instrument('SIM::INSTR') or create a
+SimInstrument directly to change the signal.
+"""
+
+import numpy as np
+
+SIM_DESCRIPTOR = 'SIM::INSTR'
+
+########################################################################
+#############################FUNCTIONS##################################
+########################################################################
+def synth_ask(bits, sym_rate, samp_rate, record_length=None, trig_pos=0.1,
+	hi_level=-10, lo_level=-40, noise_level=-70, cfo=0, jitter=0,
+	coding='ask', seed=None):
+	"""
+	This function synthesizes the complex baseband IQ of an ASK burst
+	bits is the data sequence, sym_rate is the data rate in bits/sec
+	hi_level/lo_level are the on/off carrier levels in dBm (use a very
+	low lo_level for OOK), noise_level is the noise power in dBm
+	cfo is the carrier frequency offset in Hz
+	jitter is the RMS timing jitter of each symbol edge in symbols
+	coding is 'ask' or 'manchester' (01 = 1, 10 = 0, sent at 2x sym_rate)
+	trig_pos is the fraction of the record before the burst starts
+	Returns the IQ array in volts (50 ohm) and the burst start index
+	"""
+	rng = np.random.RandomState(seed)
+	bits = np.asarray(bits, dtype=np.uint8)
+	if coding == 'manchester':
+		chips = np.empty(2*len(bits), dtype=np.uint8)
+		chips[0::2] = 1-bits
+		chips[1::2] = bits
+		bits = chips
+		sym_rate = sym_rate*2
+	elif coding != 'ask':
+		raise ValueError('Unknown line coding: {0}'.format(coding))
+
+	sa_per_sym = float(samp_rate)/sym_rate
+	burst_length = int(np.ceil(len(bits)*sa_per_sym))
+	if record_length is None:
+		record_length = int(burst_length/(1-trig_pos))+1
+	start = int(trig_pos*record_length)
+
+	#symbol edges with timing jitter, then the symbol each sample is in
+	edges = start+np.arange(len(bits)+1)*sa_per_sym
+	edges[1:-1] += rng.randn(len(bits)-1)*jitter*sa_per_sym
+	n = np.arange(record_length)
+	sym_index = np.searchsorted(edges, n, side='right')-1
+	in_burst = (sym_index >= 0) & (sym_index < len(bits))
+	on = np.zeros(record_length, dtype=bool)
+	on[in_burst] = bits[sym_index[in_burst]] == 1
+
+	#dBm to volts peak for a 50 ohm load
+	hi_amp = np.sqrt(100*1e-3*10**(hi_level/10.0))
+	lo_amp = np.sqrt(100*1e-3*10**(lo_level/10.0))
+	amp = np.where(on, hi_amp, 0.0)
+	amp[in_burst & ~on] = lo_amp
+	iq = amp*np.exp(2j*np.pi*cfo*n/samp_rate)
+
+	noise_amp = np.sqrt(100*1e-3*10**(noise_level/10.0)/2)
+	iq += noise_amp*(rng.randn(record_length)+1j*rng.randn(record_length))
+	return iq.astype(np.complex64), start
+
+def iq_to_dbm(iq):
+	#convert IQ in volts (50 ohm) to amplitude vs time in dBm
+	return (10*np.log10((np.abs(iq)**2/100)/.001)).astype(np.float32)
+
+########################################################################
+##############################CLASSES###################################
+########################################################################
+
+class SimInstrument:
+	"""
+	Simulated RSA that quacks like a PyVISA instrument object
+	Supports write(), ask()/query(), read_raw(), and the visalib.read()/
+	session pair used by read_binblock(). Every 'initiate:immediate'
+	synthesizes a new capture using the span and analysis length that
+	were last written, the sample rate is 1.4x the span.
+	bits defaults to num_bits random bits, the remaining keyword
+	arguments are passed through to synth_ask(). The signal defaults to
+	OOK (lo_level below the noise floor) since the burst only fills
+	part of the record and a 2ASK lo level would be outnumbered by the
+	idle noise when the levels are estimated.
+	"""
+	def __init__(self, sym_rate=250e3, bits=None, num_bits=64, seed=None,
+		**signal):
+		self.rng = np.random.RandomState(seed)
+		self.sym_rate = sym_rate
+		self.bits = bits
+		self.num_bits = num_bits
+		signal.setdefault('lo_level', -100)
+		self.signal = signal
+		self.span = 40e6
+		self.meas_time = 400e-6
+		self.timeout = 2000
+		self.session = 0
+		self.visalib = self
+		self.settings = {}
+		self.output = b''
+		self.avt = None
+		self.capture()
+
+	def samp_rate(self):
+		return self.span*1.4
+
+	def capture(self):
+		#synthesize a new burst that fills the analysis length
+		bits = self.bits
+		if bits is None:
+			bits = self.rng.randint(0, 2, self.num_bits)
+		record_length = int(self.samp_rate()*self.meas_time)
+		iq, start = synth_ask(bits, self.sym_rate, self.samp_rate(),
+			record_length=record_length, seed=self.rng.randint(2**31),
+			**self.signal)
+		self.avt = iq_to_dbm(iq)
+		self.sent_bits = bits
+
+	def write(self, command):
+		command = command.strip()
+		header = command.split(' ')[0].lower()
+		value = command[len(header):].strip()
+		self.settings[header] = value
+		if header == 'spectrum:frequency:span':
+			self.span = float(value)
+		elif header == 'sense:analysis:length':
+			self.meas_time = float(value)
+		elif header == 'initiate:immediate':
+			self.capture()
+		elif header == 'fetch:avtime:first?':
+			data = self.avt.tostring()
+			length = str(len(data))
+			self.output = b'#' + str(len(length)) + length + data + b'\n'
+		elif header.endswith('?'):
+			self.output = self.answer(header) + '\n'
+
+	def answer(self, query):
+		if query == '*idn?':
+			return 'Tektronix,SIM,SIM000,0.0'
+		elif query == '*opc?':
+			return '1'
+		elif query == 'system:error:all?':
+			return '0,"No error"'
+		elif query == 'display:avtime:x:scale:full?':
+			return repr(self.meas_time)
+		elif query == 'display:avtime:x:scale:offset?':
+			return '0'
+		return self.settings.get(query[:-1], '0')
+
+	def read_raw(self):
+		output, self.output = self.output, b''
+		return output
+
+	def read(self, session=None, count=None):
+		#visalib.read(session, count) returns (data, status)
+		if count is None:
+			return self.read_raw().strip()
+		output, self.output = self.output[:count], self.output[count:]
+		return output, 0
+
+	def ask(self, command):
+		self.write(command)
+		return self.read()
+
+	query = ask
+
+	def close(self):
+		pass
@@ -0,0 +1,162 @@
+"""
+ASK_tiq.py
+Memory-mapped readers for SignalVu-PC .tiq files and raw IQ recordings
+The IQ payload is memory-mapped with np.memmap and converted to AvT one
+block at a time, so recordings of any size can be demodulated with
+AskStreamDemod from ASK_demod_guts.py without loading them into memory
+or going through SignalVu-PC and VISA.
+
+A .tiq file is an XML header followed by interleaved I/Q samples. The
+DataFile element's offset attribute is the byte offset of the samples,
+NumberFormat is IQInt16, IQInt32, or IQSingle, and Scaling converts
+the integer samples to volts.
+"""
+
+import re
+import numpy as np
+from ASK_demod_guts import *
+
+#IQ formats found in .tiq headers and their numpy sample types
+TIQ_FORMATS = {'iqint16': np.int16, 'iqint32': np.int32,
+	'iqsingle': np.float32}
+#largest number of samples read to estimate levels before streaming
+LEVEL_SAMPLES = 1000000
+
+########################################################################
+##############################CLASSES###################################
+########################################################################
+
+class IQRecording:
+	"""
+	Memory-mapped interleaved IQ recording
+	iq is the np.memmap of interleaved I/Q samples, scaling converts
+	them to volts, samp_rate is in Hz (None if unknown), and info holds
+	any other header fields that were found
+	"""
+	def __init__(self, iq, scaling=1.0, samp_rate=None, info=None):
+		self.iq = iq
+		self.scaling = scaling
+		self.samp_rate = samp_rate
+		self.info = info or {}
+
+	def __len__(self):
+		return len(self.iq)//2
+
+	def iq_block(self, start, stop):
+		"""Returns scaled float32 I and Q for samples start to stop"""
+		block = self.iq[2*start:2*stop].astype(np.float32)
+		if self.scaling != 1.0:
+			block *= self.scaling
+		return block[0::2], block[1::2]
+
+	def avt_blocks(self, block_length=1048576):
+		"""Generator that yields the AvT trace in dBm one block at a time"""
+		for start in xrange(0, len(self), block_length):
+			I, Q = self.iq_block(start, min(start+block_length, len(self)))
+			yield iq_to_avt(I, Q)
+
+	def level_sample(self, max_samples=LEVEL_SAMPLES):
+		"""
+		Returns the AvT of at most max_samples samples spread evenly over
+		the whole recording, for estimating the hi/lo levels up front
+		"""
+		step = max(len(self)//max_samples, 1)
+		iq = self.iq[:2*len(self)].reshape(-1, 2)[::step].astype(np.float32)
+		iq *= self.scaling
+		return iq_to_avt(iq[:,0], iq[:,1])
+
+########################################################################
+#############################FUNCTIONS##################################
+########################################################################
+def read_tiq_header(path, max_header=1048576):
+	"""
+	This function parses the XML header of a .tiq file and returns a
+	dict with the data offset, number format, number of samples,
+	scaling, sample rate, center frequency, and endianness
+	"""
+	with open(path, 'rb') as tiq:
+		header = tiq.read(max_header)
+	end = header.find(b'</DataFile>')
+	if end < 0:
+		raise ValueError('{0} is not a .tiq file (no DataFile header).'.format(path))
+	header = header[:end].decode('utf-8', 'replace')
+
+	def field(name, default=None):
+		match = re.search(r'<{0}\b[^>]*>\s*([^<]+?)\s*</{0}>'.format(name), header)
+		if match is None:
+			return default
+		return match.group(1)
+
+	offset = re.search(r'<DataFile\b[^>]*\boffset="\s*(\d+)\s*"', header)
+	if offset is None:
+		raise ValueError('{0} has no data offset in its header.'.format(path))
+	number_format = field('NumberFormat', 'IQInt16')
+	if number_format.lower() not in TIQ_FORMATS:
+		raise ValueError('Unsupported .tiq number format: {0}'.format(number_format))
+	samp_rate = field('SamplingFrequency')
+	center_freq = field('CenterFrequency')
+	num_samples = field('NumberSamples')
+	return {'offset': int(offset.group(1)),
+		'number_format': number_format,
+		'num_samples': int(num_samples) if num_samples is not None else None,
+		'scaling': float(field('Scaling', 1.0)),
+		'samp_rate': float(samp_rate) if samp_rate is not None else None,
+		'center_freq': float(center_freq) if center_freq is not None else None,
+		'endian': field('Endian', 'Little')}
+
+def open_tiq(path):
+	"""This function memory-maps the IQ payload of a .tiq file"""
+	info = read_tiq_header(path)
+	dtype = np.dtype(TIQ_FORMATS[info['number_format'].lower()])
+	if info['endian'].lower().startswith('big'):
+		dtype = dtype.newbyteorder('>')
+	else:
+		dtype = dtype.newbyteorder('<')
+	count = -1
+	if info['num_samples'] is not None:
+		count = 2*info['num_samples']
+	iq = np.memmap(path, dtype=dtype, mode='r', offset=info['offset'],
+		shape=(count,) if count > 0 else None)
+	return IQRecording(iq, info['scaling'], info['samp_rate'], info)
+
+def open_raw_iq(path, dtype=np.float32, samp_rate=None, scaling=1.0, offset=0):
+	"""
+	This function memory-maps a raw interleaved IQ file (float32 or int16
+	by default, any numpy type works) starting offset bytes into the file
+	"""
+	iq = np.memmap(path, dtype=dtype, mode='r', offset=offset)
+	return IQRecording(iq, scaling, samp_rate)
+
+def open_recording(path, samp_rate=None, dtype=np.float32, scaling=1.0):
+	"""
+	This function opens a .tiq file or, for any other extension, a raw
+	interleaved IQ file of dtype samples that scaling converts to volts
+	(.tiq files store their own). samp_rate overrides the rate stored
+	in the file.
+	"""
+	if path.lower().endswith('.tiq'):
+		recording = open_tiq(path)
+	else:
+		recording = open_raw_iq(path, dtype, scaling=scaling)
+	if samp_rate is not None:
+		recording.samp_rate = samp_rate
+	if recording.samp_rate is None:
+		raise ValueError('No sample rate stored in {0}.'.format(path))
+	return recording
+
+def demod_recording(recording, sym_rate, thresh, block_length=1048576):
+	"""
+	This function streams a recording through AskStreamDemod block by
+	block. The hi level is estimated first from an evenly spaced sample
+	of the whole recording so an idle first block can't skew it.
+	Returns the symbol table and the AskStreamDemod (for its levels,
+	level confidence, decision point, and start index).
+	"""
+	hi, lo, confidence = level_estimator(recording.level_sample())
+	demod = AskStreamDemod(sym_rate, recording.samp_rate, thresh, hi=hi)
+	demod.lo = lo
+	demod.confidence = confidence
+	tables = list(demod.demod_blocks(recording.avt_blocks(block_length)))
+	if not tables:
+		return np.zeros(0, dtype=np.uint8), demod
+	return np.concatenate(tables), demod
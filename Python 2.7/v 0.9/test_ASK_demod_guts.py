@@ -0,0 +1,346 @@
+"""
+test_ASK_demod_guts.py
+Tests for ASK_demod_guts.py, run from this folder with
+python -m unittest test_ASK_demod_guts
+"""
+
+import unittest
+import numpy as np
+
+from ASK_sim import SimInstrument, SIM_DESCRIPTOR
+
+try:
+	import ASK_demod_guts as guts
+except ImportError:
+	#ASK_demod_guts needs PyVISA and matplotlib
+	guts = None
+
+########################################################################
+#############################FUNCTIONS##################################
+########################################################################
+def loop_slicer(data, d_point, start_index, dec_offset, sa_per_sym, valid_sym):
+	#the per-symbol loop ask_decode used before symbol_slicer
+	sym_table = []
+	for i in range(valid_sym):
+		index = int(i*sa_per_sym+dec_offset+start_index)
+		if index >= len(data):
+			break
+		if data[index] >= d_point:
+			sym_table.append(1)
+		else:
+			sym_table.append(0)
+	return np.array(sym_table, dtype=np.uint8)
+
+def random_trace(rng, sa_per_sym, lead, num_sym, noise=3):
+	#random symbols held for sa_per_sym samples after lead samples of idle
+	bits = rng.randint(0, 2, num_sym)
+	bits[0] = 1
+	index = (np.arange(int(num_sym*sa_per_sym))/sa_per_sym).astype(np.int64)
+	data = np.full(lead+len(index), -60.0)
+	data[lead:] = np.where(bits[index] == 1, -20.0, -60.0)
+	return data+rng.randn(len(data))*noise
+
+def drifting_trace(rng, bits, sa_per_sym, drift, lead=100, noise=1):
+	#symbol n starts at lead+n*sa_per_sym*(1+drift*n/len(bits))
+	n = np.arange(len(bits)+1)
+	edges = lead+n*sa_per_sym*(1+drift*n/float(len(bits)))
+	index = np.searchsorted(edges, np.arange(int(edges[-1])), 'right')-1
+	data = np.full(len(index), -60.0)
+	data[index >= 0] = np.where(bits[index[index >= 0]] == 1, -20.0, -60.0)
+	return data+rng.randn(len(data))*noise, edges
+
+def manchester_encode(bits, differential=False):
+	#01 = 1, 10 = 0, or differential: no transition at the bit start = 1
+	chips = np.empty(2*len(bits), dtype=np.uint8)
+	if differential:
+		level = 0
+		for i, bit in enumerate(bits):
+			if bit == 0:
+				level = 1-level
+			chips[2*i] = level
+			level = 1-level
+			chips[2*i+1] = level
+	else:
+		chips[0::2] = 1-np.asarray(bits)
+		chips[1::2] = bits
+	return chips
+
+def sync_pattern(word):
+	return np.array([int(bit) for bit in word], dtype=np.uint8)
+
+def loop_frame_sync(sym_table, sync_words, max_errors=0):
+	#every match best first, kept unless it overlaps one already kept
+	matches = []
+	for i, word in enumerate(sync_words):
+		word = sync_pattern(word)
+		for start in range(len(sym_table)-len(word)+1):
+			errors = (sym_table[start:start+len(word)] != word).sum()
+			if errors <= max_errors:
+				matches.append((errors, start, i, len(word)))
+	taken = []
+	for errors, start, i, length in sorted(matches):
+		if all((start+length <= other) or (start >= other+other_length)
+			for other, other_length, j, other_errors in taken):
+			taken.append((start, length, i, errors))
+	return [(start, i, errors) for start, length, i, errors in sorted(taken)]
+
+########################################################################
+###############################TESTS####################################
+########################################################################
+@unittest.skipIf(guts is None, 'ASK_demod_guts needs PyVISA and matplotlib')
+class SymbolSlicerTest(unittest.TestCase):
+	def test_matches_loop(self):
+		rng = np.random.RandomState(1)
+		for trial in range(200):
+			sa_per_sym = rng.uniform(2, 40)
+			data = random_trace(rng, sa_per_sym, rng.randint(0, 200),
+				rng.randint(8, 300))
+			start_index = rng.randint(0, 200)
+			dec_offset = int(sa_per_sym/2)
+			#ask for a few symbols past the end so they have to be trimmed
+			valid_sym = int(len(data)/sa_per_sym)+rng.randint(0, 4)
+			expected = loop_slicer(data, -40, start_index, dec_offset,
+				sa_per_sym, valid_sym)
+			sym_table = guts.symbol_slicer(data, -40, start_index, dec_offset,
+				sa_per_sym, valid_sym)
+			self.assertEqual(sym_table.dtype, np.uint8)
+			np.testing.assert_array_equal(sym_table, expected)
+
+	def test_ask_decode_matches_loop(self):
+		rng = np.random.RandomState(2)
+		for trial in range(50):
+			sa_per_sym = rng.uniform(4, 40)
+			data = random_trace(rng, sa_per_sym, rng.randint(0, 200),
+				rng.randint(16, 300))
+			hi, lo = guts.hi_lo_calculator(data)
+			start_index, d_point = guts.firstedge_finder(data, hi, lo, 3)
+			dec_offset = int(sa_per_sym/2)
+			valid_sym = (int(len(data)/sa_per_sym)-
+				int((start_index+dec_offset)/sa_per_sym))
+			expected = loop_slicer(data, d_point, start_index, dec_offset,
+				sa_per_sym, valid_sym)
+			sym_table, annot = guts.ask_decode(data, 1., sa_per_sym, 3)
+			np.testing.assert_array_equal(sym_table, expected)
+			self.assertEqual(annot[3], len(expected))
+
+	def test_trims_past_end(self):
+		data = np.array([-20., -60., -20., -60., -20.])
+		sym_table = guts.symbol_slicer(data, -40, 0, 0, 2, 10)
+		np.testing.assert_array_equal(sym_table, [1, 1, 1])
+
+@unittest.skipIf(guts is None, 'ASK_demod_guts needs PyVISA and matplotlib')
+class SymRateEstimatorTest(unittest.TestCase):
+	def test_period_fit(self):
+		rng = np.random.RandomState(12)
+		intervals = rng.randint(1, 6, 200)*7.3+rng.randn(200)*0.1
+		period, fit = guts.period_fit(intervals, 7.0)
+		self.assertAlmostEqual(period, 7.3, delta=0.01)
+		self.assertEqual(fit, 1.0)
+		#half the intervals off the grid
+		intervals[::2] += 3.65
+		period, fit = guts.period_fit(intervals, 7.3, passes=0)
+		self.assertEqual(period, 7.3)
+		self.assertEqual(fit, 0.5)
+
+	def test_methods(self):
+		rng = np.random.RandomState(13)
+		#down to 4.3 samples per symbol, where single symbol runs are
+		#4 or 5 samples long
+		for sa_per_sym in (4.3, 8., 17.5, 40.):
+			for method in ('edges', 'fft'):
+				data = random_trace(rng, sa_per_sym, 100, 500, noise=1)
+				sym_rate, confidence = guts.sym_rate_estimator(data, 1e6, 3,
+					method)
+				self.assertAlmostEqual(sym_rate*sa_per_sym/1e6, 1, delta=0.001)
+				self.assertGreater(confidence, 0.8)
+
+	def test_noise_only(self):
+		rng = np.random.RandomState(14)
+		for data in (-60+rng.randn(10000), np.full(1000, -60.0)):
+			for method in ('edges', 'fft'):
+				self.assertEqual(guts.sym_rate_estimator(data, 1e6, 3, method),
+					(None, 0.0))
+		self.assertRaises(ValueError, guts.ask_decode, -60+rng.randn(10000),
+			None, 1e6, 3)
+
+	def test_unknown_method(self):
+		data = random_trace(np.random.RandomState(15), 8., 100, 100)
+		self.assertRaises(ValueError, guts.sym_rate_estimator, data, 1e6, 3,
+			'autocorrelation')
+
+	def test_ask_decode_estimated_rate(self):
+		rng = np.random.RandomState(16)
+		for trial in range(10):
+			sa_per_sym = rng.uniform(5, 40)
+			data = random_trace(rng, sa_per_sym, rng.randint(0, 200), 300,
+				noise=1)
+			expected, expected_annot = guts.ask_decode(data, 1./sa_per_sym,
+				1., 3)
+			sym_table, annot = guts.ask_decode(data, None, 1., 3)
+			self.assertAlmostEqual(annot[4]/sa_per_sym, 1, delta=0.001)
+			np.testing.assert_array_equal(sym_table, expected)
+
+@unittest.skipIf(guts is None, 'ASK_demod_guts needs PyVISA and matplotlib')
+class TrackingTest(unittest.TestCase):
+	def setUp(self):
+		rng = np.random.RandomState(5)
+		self.bits = rng.randint(0, 2, 2000)
+		self.bits[0] = 1
+		#the clock runs 1% slow by the end of the record
+		self.data, self.edges = drifting_trace(rng, self.bits, 10., 0.01)
+
+	def test_decisions(self):
+		for decision in ('sample', 'integrate'):
+			sym_table, annot = guts.ask_decode(self.data, 1., 10., 3, decision,
+				track=True)
+			self.assertEqual(len(annot), 6)
+			dec_index = annot[5]
+			self.assertEqual(len(dec_index), len(sym_table))
+			#every decision lands inside its own symbol
+			n = np.arange(len(dec_index))
+			self.assertTrue((dec_index > self.edges[n]).all())
+			self.assertTrue((dec_index < self.edges[n+1]).all())
+			if decision == 'sample':
+				np.testing.assert_array_equal(sym_table,
+					self.bits[:len(sym_table)])
+				np.testing.assert_array_equal(
+					self.data[dec_index] >= annot[0], sym_table)
+
+	def test_bursts_offset(self):
+		gap = np.full(5000, -60.0)
+		data = np.concatenate((gap, self.data, gap))
+		[(start_time, sym_table, annot)] = guts.demod_bursts(data, 1., 10., 3,
+			track=True)
+		np.testing.assert_array_equal(sym_table, self.bits[:len(sym_table)])
+		np.testing.assert_array_equal(
+			data[annot[5]] >= annot[0], sym_table)
+
+@unittest.skipIf(guts is None, 'ASK_demod_guts needs PyVISA and matplotlib')
+class ManchesterTest(unittest.TestCase):
+	def setUp(self):
+		self.bits = np.random.RandomState(3).randint(0, 2, 500).astype(np.uint8)
+
+	def test_clean(self):
+		manch_table, errors = guts.manchester_decode(
+			manchester_encode(self.bits))
+		np.testing.assert_array_equal(manch_table, self.bits)
+		self.assertEqual(len(errors), 0)
+
+	def test_odd_alignment(self):
+		#a stray leading symbol puts the pairs on odd symbols
+		chips = np.concatenate(([1-self.bits[0]], manchester_encode(self.bits)))
+		manch_table, errors = guts.manchester_decode(chips)
+		np.testing.assert_array_equal(manch_table, self.bits)
+
+	def test_error_does_not_restart(self):
+		chips = manchester_encode(self.bits)
+		chips[201] = chips[200]
+		manch_table, errors = guts.manchester_decode(chips)
+		np.testing.assert_array_equal(errors, [200])
+		np.testing.assert_array_equal(manch_table,
+			np.delete(self.bits, 100))
+
+	def test_slip_realigns(self):
+		#a dropped symbol shifts every later pair by one
+		chips = np.delete(manchester_encode(self.bits), 801)
+		manch_table, errors = guts.manchester_decode(chips)
+		self.assertEqual(len(errors), 1)
+		np.testing.assert_array_equal(manch_table[:400], self.bits[:400])
+		np.testing.assert_array_equal(manch_table[-95:], self.bits[-95:])
+
+	def test_differential(self):
+		manch_table, errors = guts.manchester_decode(
+			manchester_encode(self.bits, True), differential=True)
+		#the first bit has no reference
+		np.testing.assert_array_equal(manch_table, self.bits[1:])
+		self.assertEqual(len(errors), 0)
+
+@unittest.skipIf(guts is None, 'ASK_demod_guts needs PyVISA and matplotlib')
+class FrameSyncTest(unittest.TestCase):
+	def test_frames(self):
+		rng = np.random.RandomState(6)
+		sync = '1110010110'
+		payloads = [rng.randint(0, 2, n) for n in (40, 25, 60)]
+		sym_table = np.concatenate([np.concatenate((manchester_encode([1]*8),
+			sync_pattern(sync), payload)) for payload in payloads])
+		frames = guts.frame_sync(sym_table, sync)
+		self.assertEqual([frame[0] for frame in frames], [16, 82, 133])
+		for frame, payload in zip(frames, payloads):
+			self.assertEqual(frame[1:3], (0, 0))
+			#the next frame's preamble is part of the payload
+			np.testing.assert_array_equal(frame[3][:len(payload)], payload)
+		frames = guts.frame_sync(sym_table, [sync], frame_length=20)
+		self.assertEqual([len(frame[3]) for frame in frames], [20, 20, 20])
+
+	def test_matches_loop(self):
+		rng = np.random.RandomState(7)
+		for trial in range(30):
+			sym_table = rng.randint(0, 2, 400).astype(np.uint8)
+			words = [''.join(str(bit) for bit in rng.randint(0, 2, n))
+				for n in rng.randint(4, 12, rng.randint(1, 4))]
+			max_errors = rng.randint(0, 3)
+			expected = loop_frame_sync(sym_table, words, max_errors)
+			frames = guts.frame_sync(sym_table, words, max_errors)
+			self.assertEqual([frame[:3] for frame in frames], expected)
+
+@unittest.skipIf(guts is None, 'ASK_demod_guts needs PyVISA and matplotlib')
+class AskDemodulatorTest(unittest.TestCase):
+	def test_matches_ask_decode(self):
+		rng = np.random.RandomState(8)
+		for decision in ('sample', 'integrate'):
+			#few lengths so the cached templates get reused and evicted
+			demodulator = guts.AskDemodulator(1., 1./9.3, 3, decision=decision,
+				cache_size=2)
+			for trial in range(20):
+				data = random_trace(rng, 9.3, rng.randint(0, 100),
+					rng.choice([50, 60, 70]))
+				sym_table, annot = demodulator.demod(data)
+				expected, expected_annot = guts.ask_decode(data, 1./9.3, 1., 3,
+					decision)
+				np.testing.assert_array_equal(sym_table, expected)
+				self.assertEqual(annot, expected_annot)
+				hi, lo, confidence = guts.level_estimator(data)
+				self.assertEqual(demodulator.levels[:2], (hi, lo))
+				self.assertEqual(demodulator.levels[2], confidence)
+			self.assertEqual(len(demodulator.templates), 2)
+
+	def test_manchester(self):
+		rng = np.random.RandomState(9)
+		bits = rng.randint(0, 2, 300)
+		chips = manchester_encode(bits)
+		#idle before the burst
+		chips = np.concatenate(([0, 0, 0], chips))
+		index = (np.arange(len(chips)*8)/8).astype(np.int64)
+		data = np.where(chips[index] == 1, -20.0, -60.0)+rng.randn(len(index))
+		demodulator = guts.AskDemodulator(8., 0.5, 3, coding='manchester')
+		manch_table, annot = demodulator.demod(data)
+		sym_table, annot = guts.ask_decode(data, 1., 8., 3)
+		expected, errors = guts.manchester_decode(sym_table)
+		np.testing.assert_array_equal(manch_table, expected)
+		np.testing.assert_array_equal(demodulator.errors, errors)
+
+@unittest.skipIf(guts is None, 'ASK_demod_guts needs PyVISA and matplotlib')
+class SimInstrumentTest(unittest.TestCase):
+	def decoded(self, inst):
+		guts.acquire(inst)
+		avt, Fs, acq_time, status_text = guts.get_avt(inst)
+		sym_table, annot = guts.ask_decode(avt, 250e3, Fs, 3)
+		#the table starts at the first rising edge
+		sent_bits = inst.sent_bits[np.argmax(inst.sent_bits):]
+		return sym_table[:len(sent_bits)], sent_bits
+
+	def test_default_round_trip(self):
+		for seed in range(40):
+			sym_table, sent_bits = self.decoded(SimInstrument(seed=seed))
+			np.testing.assert_array_equal(sym_table, sent_bits)
+
+	def test_descriptor(self):
+		inst, status_text = guts.Tek_Instrument(SIM_DESCRIPTOR)
+		try:
+			sym_table, sent_bits = self.decoded(inst)
+			np.testing.assert_array_equal(sym_table, sent_bits)
+		finally:
+			guts.visa_sessions.close(SIM_DESCRIPTOR)
+
+if __name__ == '__main__':
+	unittest.main()
@@ -0,0 +1,102 @@
+"""
+test_ASK_export.py
+Tests for ASK_export.py, run from this folder with
+python -m unittest test_ASK_export
+"""
+
+import os
+import shutil
+import tempfile
+import unittest
+import numpy as np
+import ASK_export
+from ASK_export import export_symbols, load_symbols, symbol_metadata
+
+########################################################################
+###############################TESTS####################################
+########################################################################
+class ExportTest(unittest.TestCase):
+	def setUp(self):
+		self.folder = tempfile.mkdtemp()
+		#not a multiple of 8 or of the line length
+		self.sym_table = np.random.RandomState(4).randint(0, 2, 1003).astype(np.uint8)
+
+	def tearDown(self):
+		shutil.rmtree(self.folder)
+
+	def path(self, name):
+		return os.path.join(self.folder, name)
+
+	def test_text(self):
+		export_symbols(self.path('table.txt'), self.sym_table)
+		with open(self.path('table.txt'), 'rb') as saved:
+			lines = saved.read().split(b'\n')
+		self.assertEqual(lines[-1], b'')
+		self.assertTrue(all(len(line) == 64 for line in lines[:-2]))
+		text = b''.join(lines)
+		self.assertEqual(text, b''.join(str(bit).encode() for bit in self.sym_table))
+
+	def test_packed_round_trip(self):
+		for name in ('table.bin', 'table.hex'):
+			export_symbols(self.path(name), self.sym_table)
+			sym_table, meta = load_symbols(self.path(name))
+			#padded to whole bytes with zeros
+			self.assertEqual(len(sym_table), 1008)
+			np.testing.assert_array_equal(sym_table[:1003], self.sym_table)
+			self.assertFalse(sym_table[1003:].any())
+			self.assertEqual(meta, {})
+
+	def test_npz_round_trip(self):
+		annot = [-13.0, 250, 4, 1003, 8.0]
+		meta = symbol_metadata(annot, 56e6, 7e6, hi=-10.0, lo=-50.0)
+		export_symbols(self.path('table.npz'), self.sym_table, meta)
+		sym_table, saved = load_symbols(self.path('table.npz'))
+		np.testing.assert_array_equal(sym_table, self.sym_table)
+		self.assertEqual(saved['start_index'], 250)
+		self.assertEqual(saved['sa_per_sym'], 8.0)
+		self.assertEqual(saved['sym_rate'], 7e6)
+		self.assertAlmostEqual(saved['first_symbol_time'], 254/56e6)
+		self.assertAlmostEqual(saved['symbol_period'], 8/56e6)
+
+	def test_manchester_metadata(self):
+		#annot and the rate describe chips, the table holds decoded bits
+		annot = [-13.0, 250, 4, 2006, 8.0, np.arange(254, 16302, 8)]
+		meta = symbol_metadata(annot, 56e6, 7e6, manchester=True,
+			invalid_pairs=3)
+		export_symbols(self.path('table.npz'), self.sym_table, meta)
+		sym_table, saved = load_symbols(self.path('table.npz'))
+		np.testing.assert_array_equal(sym_table, self.sym_table)
+		self.assertTrue(saved['manchester'])
+		self.assertEqual(saved['sym_rate'], 3.5e6)
+		self.assertEqual(saved['sa_per_sym'], 16.0)
+		self.assertAlmostEqual(saved['symbol_period'], 16/56e6)
+		self.assertEqual(saved['chip_rate'], 7e6)
+		self.assertEqual(saved['sa_per_chip'], 8.0)
+		self.assertAlmostEqual(saved['chip_period'], 8/56e6)
+		self.assertEqual(saved['chip_dec_offset'], 4)
+		self.assertAlmostEqual(saved['first_chip_time'], 254/56e6)
+		np.testing.assert_array_equal(saved['chip_dec_index'], annot[5])
+		self.assertEqual(saved['invalid_pairs'], 3)
+		for name in ('dec_offset', 'dec_index', 'first_symbol_time'):
+			self.assertNotIn(name, saved)
+
+	def test_chunks(self):
+		#tables longer than one chunk come out the same
+		sym_table = np.concatenate((self.sym_table,
+			np.zeros(ASK_export.CHUNK_SYMBOLS, dtype=np.uint8), self.sym_table))
+		for name in ('table.txt', 'table.bin', 'table.hex'):
+			export_symbols(self.path(name), sym_table)
+		for name in ('table.bin', 'table.hex'):
+			saved, meta = load_symbols(self.path(name))
+			np.testing.assert_array_equal(saved[:len(sym_table)], sym_table)
+		with open(self.path('table.txt'), 'rb') as saved:
+			text = saved.read().replace(b'\n', b'')
+		np.testing.assert_array_equal(np.frombuffer(text, dtype=np.uint8)-ord('0'),
+			sym_table)
+
+	def test_unknown_format(self):
+		self.assertRaises(ValueError, export_symbols, self.path('table.csv'),
+			self.sym_table)
+
+if __name__ == '__main__':
+	unittest.main()
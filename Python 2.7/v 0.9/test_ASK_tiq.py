@@ -0,0 +1,154 @@
+"""
+test_ASK_tiq.py
+Tests for ASK_tiq.py and the raw IQ path of ASK_batch.py, run from
+this folder with
+python -m unittest test_ASK_tiq
+"""
+
+import json
+import os
+import shutil
+import sys
+import tempfile
+import unittest
+from StringIO import StringIO
+import numpy as np
+from ASK_sim import synth_ask
+
+try:
+	import ASK_batch
+	from ASK_tiq import read_tiq_header, open_recording, demod_recording
+except ImportError:
+	#ASK_demod_guts needs PyVISA and matplotlib
+	ASK_batch = None
+
+SYM_RATE = 100e3
+SAMP_RATE = 2e6
+
+########################################################################
+#############################FUNCTIONS##################################
+########################################################################
+def int16_iq(iq):
+	#interleaved int16 IQ and the volts per count that restores it
+	scaling = np.abs(np.concatenate((iq.real, iq.imag))).max()/30000
+	samples = np.empty(2*len(iq), dtype=np.int16)
+	samples[0::2] = np.round(iq.real/scaling)
+	samples[1::2] = np.round(iq.imag/scaling)
+	return samples, scaling
+
+def write_tiq(path, samples, scaling, samp_rate, endian='Little'):
+	"""
+	Writes a SignalVu-PC style .tiq: an XML header whose DataFile offset
+	is the header length, followed by the interleaved IQInt16 samples
+	"""
+	header = ('<?xml version="1.0" encoding="utf-8"?>\n'
+		'<DataFile offset="{offset:010d}" version="1.0">\n'
+		' <DataSetsCollection><DataSets><DataDescription>\n'
+		'  <NumberSamples>{num_samples}</NumberSamples>\n'
+		'  <NumberFormat>IQInt16</NumberFormat>\n'
+		'  <Endian>{endian}</Endian>\n'
+		'  <Scaling>{scaling!r}</Scaling>\n'
+		'  <SamplingFrequency>{samp_rate!r}</SamplingFrequency>\n'
+		'  <CenterFrequency>1000000000</CenterFrequency>\n'
+		' </DataDescription></DataSets></DataSetsCollection>\n'
+		'</DataFile>\n')
+	fields = {'num_samples': len(samples)//2, 'endian': endian,
+		'scaling': scaling, 'samp_rate': samp_rate}
+	#the offset is fixed width, so the header length doesn't depend on it
+	offset = len(header.format(offset=0, **fields))
+	dtype = np.dtype(np.int16).newbyteorder('>' if endian == 'Big' else '<')
+	with open(path, 'wb') as tiq:
+		tiq.write(header.format(offset=offset, **fields).encode('utf-8'))
+		tiq.write(samples.astype(dtype).tostring())
+	return offset
+
+def first_edge_bits(bits):
+	#the demod starts at the first rising edge
+	return bits[np.argmax(bits):]
+
+########################################################################
+###############################TESTS####################################
+########################################################################
+@unittest.skipIf(ASK_batch is None, 'ASK_demod_guts needs PyVISA and matplotlib')
+class TiqTest(unittest.TestCase):
+	def setUp(self):
+		self.folder = tempfile.mkdtemp()
+		rng = np.random.RandomState(10)
+		self.bits = rng.randint(0, 2, 400).astype(np.uint8)
+		self.iq, start = synth_ask(self.bits, SYM_RATE, SAMP_RATE,
+			lo_level=-100, seed=11)
+		self.samples, self.scaling = int16_iq(self.iq)
+
+	def tearDown(self):
+		shutil.rmtree(self.folder)
+
+	def path(self, name):
+		return os.path.join(self.folder, name)
+
+	def test_header(self):
+		offset = write_tiq(self.path('capture.tiq'), self.samples, self.scaling,
+			SAMP_RATE)
+		info = read_tiq_header(self.path('capture.tiq'))
+		self.assertEqual(info['offset'], offset)
+		self.assertEqual(info['number_format'], 'IQInt16')
+		self.assertEqual(info['num_samples'], len(self.iq))
+		self.assertEqual(info['scaling'], self.scaling)
+		self.assertEqual(info['samp_rate'], SAMP_RATE)
+		self.assertEqual(info['center_freq'], 1e9)
+		self.assertEqual(info['endian'], 'Little')
+
+	def test_not_tiq(self):
+		with open(self.path('capture.tiq'), 'wb') as tiq:
+			tiq.write(self.samples.tostring())
+		self.assertRaises(ValueError, read_tiq_header, self.path('capture.tiq'))
+
+	def test_open_tiq(self):
+		for endian in ('Little', 'Big'):
+			write_tiq(self.path('capture.tiq'), self.samples, self.scaling,
+				SAMP_RATE, endian)
+			recording = open_recording(self.path('capture.tiq'))
+			self.assertEqual(len(recording), len(self.iq))
+			self.assertEqual(recording.samp_rate, SAMP_RATE)
+			I, Q = recording.iq_block(0, len(recording))
+			#within half a count of the synthesized volts
+			np.testing.assert_allclose(I, self.iq.real, atol=self.scaling*0.6)
+			np.testing.assert_allclose(Q, self.iq.imag, atol=self.scaling*0.6)
+			del recording, I, Q
+
+	def test_demod_recording(self):
+		write_tiq(self.path('capture.tiq'), self.samples, self.scaling,
+			SAMP_RATE)
+		recording = open_recording(self.path('capture.tiq'))
+		#several blocks, with block edges inside symbols
+		sym_table, demod = demod_recording(recording, SYM_RATE, 3,
+			block_length=1234)
+		sent_bits = first_edge_bits(self.bits)
+		np.testing.assert_array_equal(sym_table[:len(sent_bits)], sent_bits)
+		self.assertAlmostEqual(demod.hi, -10, delta=3)
+		del recording
+
+	def test_batch_raw_int16(self):
+		self.samples.tofile(self.path('capture.dat'))
+		output = self.path('results.json')
+		stdout, sys.stdout = sys.stdout, StringIO()
+		try:
+			ASK_batch.main([self.path('*.dat'), '-r', repr(SYM_RATE),
+				'--samp-rate', repr(SAMP_RATE), '--raw-dtype', 'int16',
+				'--scaling', repr(self.scaling), '-j', '1', '-o', output])
+		finally:
+			sys.stdout = stdout
+		with open(output) as saved:
+			[result] = json.load(saved)['results']
+		self.assertNotIn('error', result)
+		self.assertEqual(result['samples'], len(self.iq))
+		self.assertAlmostEqual(result['hi'], -10, delta=3)
+		sent_bits = first_edge_bits(self.bits)
+		symbols = np.array([int(bit) for bit in result['symbols']])
+		np.testing.assert_array_equal(symbols[:len(sent_bits)], sent_bits)
+		#without the scaling the levels are in raw counts
+		[result], summary = ASK_batch.run_batch([self.path('capture.dat')],
+			SYM_RATE, 3, samp_rate=SAMP_RATE, processes=1, raw_dtype='int16')
+		self.assertGreater(result['hi'], 40)
+
+if __name__ == '__main__':
+	unittest.main()